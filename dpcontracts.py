@@ -442,20 +442,25 @@ Contracts can be placed on coroutines (that is, async functions):
     >>> asyncio.get_event_loop().run_until_complete(
     ...     func( 1, "foo", True, True, False))
 
-Predicates functions themselves cannot be coroutines, as this could
-influence the run loop:
-
-    >>> async def coropred_aisint(e):
-    ...     await asyncio.sleep(1)
-    ...     return isinstance(getattr(e, 'a'), int)
-    >>> @require("`a` is an integer", coropred_aisint)
-    ... @require("`b` is a string", lambda args: isinstance(args.b, str))
-    ... @require("every member of `c` should be a boolean",
-    ...          lambda args: all(isinstance(x, bool) for x in args.c))
-    ... async def func(a, b="Foo", *c):
-    ...     await asyncio.sleep(1)
+Predicates on coroutine functions can themselves be coroutine functions, in
+which case they are awaited, and ordinary predicates can be run in an
+executor by passing ``executor`` to ``require`` or ``ensure``.  The other
+predicates are checked first; the ones to be awaited then run concurrently:
+
+    >>> async def is_integer(args):
+    ...     await asyncio.sleep(0.01)
+    ...     return isinstance(args.a, int)
+
+    >>> @require("`a` is an integer", is_integer)
+    ... @require("`a` is positive", lambda args: args.a > 0, executor=True)
+    ... async def func(a):
+    ...     return a
+
+    >>> asyncio.get_event_loop().run_until_complete(func(1))
+    1
+    >>> asyncio.get_event_loop().run_until_complete(func(-1.0))
     Traceback (most recent call last):
-    AssertionError: contract predicates cannot be coroutines
+    PreconditionError: `a` is an integer
 
 Contracts and Debugging
 =======================
@@ -469,189 +474,2552 @@ Testing This Module
 This module has embedded doctests that are run with the module is invoked
 from the command line.  Simply run the module directly to run the tests.
 
-Contact Information and Licensing
-=================================
-This module has a home page at `GitHub <https://github.com/deadpixi/contracts>`_.
+Contact Information and Licensing
+=================================
+This module has a home page at `GitHub <https://github.com/deadpixi/contracts>`_.
+
+This module was written by Rob King (jking@deadpixi.com).
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__all__ = ["ensure", "invariant", "require", "transform", "rewrite",
+           "preserve", "PreconditionError", "PostconditionError",
+           "set_level", "get_level", "set_sampling", "sampled",
+           "RateSampler", "EveryNthSampler", "TokenBucketSampler", "BudgetSampler",
+           "ContractProfiler", "set_profiler", "Failure", "in_bounds", "all_finite",
+           "has_dtype", "has_shape", "is_monotonic", "all_unique", "require_each",
+           "ensure_each", "set_type_checking", "attributes", "digest", "snapshot",
+           "copy_on_write", "Snapshot", "set_violation_handler",
+           "DeferredChecker", "set_deferred_checker", "memoized", "suppressed",
+           "recursive", "set_inlining"]
+__author__ = "Rob King"
+__copyright__ = "Copyright (C) 2015-2018 Rob King"
+__license__ = "LGPL"
+__version__ = "0.6.0"
+__email__ = "jking@deadpixi.com"
+__status__ = "Alpha"
+
+from functools import lru_cache, wraps
+from itertools import count, islice, repeat, tee
+from math import isfinite
+from operator import attrgetter, ge, gt, le, lt
+import sys
+from os import environ, getpid
+from random import randrange, random
+from sys import modules, version_info
+from threading import Lock, Thread, get_ident, local
+from time import monotonic, perf_counter
+from types import FunctionType, MethodType
+from weakref import WeakKeyDictionary, ref
+
+# Modules needed only for some features, such as `ast` for generated
+# descriptions, are imported where they are used, keeping the import of
+# this module cheap.
+
+if version_info[:2] < (3, 5):
+    raise ImportError('dpcontracts >= 0.6 requires Python 3.5 or later.')
+
+def current_task():
+    """
+    Return the asyncio task running in this thread, or None.
+    """
+
+    # Without a running event loop there is no current task, and if asyncio
+    # was never imported there can be no running event loop.
+    asyncio = modules.get("asyncio")
+    if asyncio is None:
+        return None
+    get_running_loop = getattr(asyncio.events, "_get_running_loop", None)
+    loop = get_running_loop() if get_running_loop is not None else None
+    if loop is None:
+        return None
+    task = getattr(asyncio, "current_task", None)
+    if task is None:
+        task = asyncio.Task.current_task
+    return task(loop)
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    class ContextVar:
+        """
+        A stand-in for `contextvars.ContextVar` on Python 3.5 and 3.6, which
+        lack the module.  It holds one value for each asyncio task, and one
+        for each thread outside of tasks; a task starts with the value of
+        the thread running its event loop.  Before Python 3.5.3, which
+        cannot find the running event loop, values are only per-thread.
+        """
+
+        def __init__(self, name, default=None):
+            self.name = name
+            self.default = default
+            self.local = local()
+            self.tasks = WeakKeyDictionary()
+
+        def get(self):
+            task = current_task()
+            if task is not None:
+                try:
+                    return self.tasks[task]
+                except KeyError:
+                    pass
+            return getattr(self.local, "value", self.default)
+
+        def set(self, value):
+            token = self.get()
+            task = current_task()
+            if task is None:
+                self.local.value = value
+            else:
+                self.tasks[task] = value
+            return token
+
+        def reset(self, token):
+            self.set(token)
+
+class OwnedVar:
+    """
+    A context variable whose value is not inherited by the asyncio tasks,
+    or threads, started while it is set: each of them sees the default
+    until it sets a value of its own.
+    """
+
+    def __init__(self, name, default=None):
+        self.var = ContextVar(name, default=None)
+        self.default = default
+
+    def get(self):
+        value = self.var.get()
+        if value is None or value[0] != (current_task() or get_ident()):
+            return self.default
+        return value[1]
+
+    def set(self, value):
+        return self.var.set((current_task() or get_ident(), value))
+
+    def reset(self, token):
+        self.var.reset(token)
+
+class PreconditionError(AssertionError):
+    """An AssertionError raised due to violation of a precondition."""
+
+class PostconditionError(AssertionError):
+    """An AssertionError raised due to violation of a postcondition."""
+
+LEVELS = {"off": 0, "pre": 1, "full": 2}
+LEVEL_NAMES = dict((number, name) for name, number in LEVELS.items())
+OFF, PRE, FULL = LEVELS["off"], LEVELS["pre"], LEVELS["full"]
+
+default_level = FULL
+module_levels = {}
+level_cache = {}
+
+def set_level(level, module=None):
+    """
+    Set which contracts are checked: "off" checks nothing, "pre" checks only
+    preconditions, and "full" checks everything.  If `module` is given, the
+    level applies only to contracts declared in that module and its
+    submodules; a `level` of None removes a module's own setting.
+    """
+
+    global default_level
+
+    if level is not None and level not in LEVELS:
+        raise ValueError("unknown contract level: %r" % (level,))
+
+    if module is None:
+        assert level is not None, "the global contract level cannot be removed"
+        default_level = LEVELS[level]
+    elif level is None:
+        module_levels.pop(module, None)
+    else:
+        module_levels[module] = LEVELS[level]
+    level_cache.clear()
+
+def get_level(module=None):
+    """
+    Return the name of the contract level in effect for `module`, or the
+    global level if no module is given.
+    """
+
+    if module is None:
+        return LEVEL_NAMES[default_level]
+    return LEVEL_NAMES[resolve_level(module)]
+
+def resolve_level(module):
+    name = module or ""
+    while name not in module_levels and "." in name:
+        name = name.rsplit(".", 1)[0]
+    level = level_cache[module] = module_levels.get(name, default_level)
+    return level
+
+def set_levels_from_environment(value):
+    """
+    Apply a level specification of the form "full" or "pre,my.module=off",
+    as found in the DPCONTRACTS_LEVEL environment variable.  Settings with
+    an unknown level are skipped with a warning, so that a typo cannot stop
+    a program from starting.
+    """
+
+    for setting in value.split(","):
+        setting = setting.strip()
+        module, level = setting.split("=", 1) if "=" in setting else (None, setting)
+        level = level.strip()
+        if not setting:
+            continue
+        if level not in LEVELS:
+            import warnings
+
+            warnings.warn("ignoring contract level setting %r: unknown level %r" % (setting, level))
+            continue
+        set_level(level, module and module.strip())
+
+set_levels_from_environment(environ.get("DPCONTRACTS_LEVEL", ""))
+
+class RateSampler:
+    """
+    A sampling policy checking a random fraction `rate` of calls.
+    """
+
+    def __init__(self, rate):
+        assert 0.0 <= rate <= 1.0, "sampling rates must be between 0 and 1"
+        self.rate = rate
+
+    def __call__(self):
+        return random() < self.rate
+
+class EveryNthSampler:
+    """
+    A sampling policy checking every `n`th call, starting with the first.
+    """
+
+    def __init__(self, n):
+        assert n >= 1, "sampling intervals must be positive"
+        self.n = n
+        self.calls = count()
+
+    def __call__(self):
+        return next(self.calls) % self.n == 0
+
+class TokenBucketSampler:
+    """
+    A sampling policy checking at most `per_second` calls per second, with
+    bursts of up to `burst` checks.
+    """
+
+    def __init__(self, per_second, burst=None):
+        assert per_second > 0, "sampling rates must be positive"
+        self.per_second = per_second
+        self.burst = burst if burst is not None else max(per_second, 1)
+        self.tokens = self.burst
+        self.last = monotonic()
+
+    def __call__(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.per_second)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class BudgetSampler:
+    """
+    A sampling policy keeping the time taken by each contract it samples
+    within `budget`, a fraction of the time taken by the function the
+    contract is checked on.  A contract is checked on every call while it
+    fits its budget, and otherwise on a random fraction of calls, never less
+    than `floor`, which grows again as its cost falls.  When a contract's
+    fraction has halved, doubled or returned to every call since it was last
+    reported, `on_throttle` is called with its description and new fraction.
+    Predicates that are awaited or deferred are not timed, and so are always
+    checked.
+    """
+
+    smoothing = 0.1
+
+    def __init__(self, budget, on_throttle=None, floor=0.01):
+        assert budget > 0, "overhead budgets must be positive"
+        assert 0.0 < floor <= 1.0, "sampling floors must be between 0 and 1"
+        self.budget = budget
+        self.on_throttle = on_throttle
+        self.floor = floor
+        # The fraction of calls checked, the fraction last reported, the mean
+        # times taken by the predicate and by the function, and the copy of
+        # the condition that times its predicate, for each condition.
+        self.contracts = {}
+
+    def state(self, condition):
+        state = self.contracts.get(condition)
+        if state is None:
+            state = self.contracts.setdefault(condition, [1.0, 1.0, None, None,
+                                                          self.timed(condition)])
+        return state
+
+    def rate(self, condition):
+        """
+        Return the fraction of calls on which `condition` is checked.
+        """
+
+        return self.state(condition)[0]
+
+    def select(self, condition):
+        """
+        Return the condition to check on this call in place of `condition`,
+        or None if it is not selected.
+        """
+
+        state = self.state(condition)
+        if state[0] >= 1.0 or random() < state[0]:
+            return state[4]
+        return None
+
+    def timed(self, condition):
+        if condition.awaited or condition.deferred:
+            return condition
+
+        predicate = condition.predicate
+
+        def timed(*arguments):
+            start = perf_counter()
+            try:
+                return predicate(*arguments)
+            finally:
+                self.record_check(condition, perf_counter() - start)
+
+        copy = TimedCondition.__new__(TimedCondition)
+        for name in Condition.__slots__:
+            setattr(copy, name, getattr(condition, name))
+        copy.original = condition
+        copy.predicate = timed
+        return copy
+
+    def record_check(self, condition, elapsed):
+        state = self.contracts[condition]
+        state[2] = elapsed if state[2] is None else \
+            state[2] + (elapsed - state[2]) * self.smoothing
+
+    def record_call(self, condition, elapsed):
+        """
+        Record the time taken by a call on which `condition` was checked,
+        and adjust the fraction of calls checking it to fit the budget.
+        """
+
+        state = self.contracts[condition]
+        state[3] = elapsed if state[3] is None else \
+            state[3] + (elapsed - state[3]) * self.smoothing
+        if state[2] is None:
+            return
+
+        rate = 1.0
+        if state[2] > 0:
+            rate = max(self.floor, min(1.0, self.budget * state[3] / state[2]))
+        state[0] = rate
+        reported = state[1]
+        if rate != reported and (rate <= reported / 2 or rate >= min(1.0, reported * 2)):
+            state[1] = rate
+            if self.on_throttle is not None:
+                self.on_throttle(condition.description, rate)
+
+def as_sampler(sample):
+    """
+    Return the sampling policy for `sample`, which is None, a policy, or a
+    number giving the fraction of calls to check.
+    """
+
+    if sample is None or callable(sample) or isinstance(sample, BudgetSampler):
+        return sample
+    return RateSampler(sample)
+
+default_sampler = None
+
+def set_sampling(sample):
+    """
+    Set the sampling policy used for postconditions and invariants that do
+    not have their own policy.  None, the default, checks every call.
+    """
+
+    global default_sampler
+    default_sampler = as_sampler(sample)
+
+def sampled(sample):
+    """
+    Apply the sampling policy `sample` to the postconditions and invariants
+    of a contracted function, or of every contracted method of a class.
+    """
+
+    sampler = as_sampler(sample)
+
+    def resample(f):
+        contracts = get_contracts(f)
+        if contracts is None:
+            return f
+        return contract_wrapper(f, contracts.replace(sampler=sampler))
+
+    def func(f):
+        if not isinstance(f, type):
+            assert get_contracts(f) is not None, "only contracted functions can be sampled"
+            return resample(f)
+
+        for name, value in list(vars(f).items()):
+            if get_contracts(value) is not None:
+                setattr(f, name, resample(value))
+        return f
+    return func
+
+class Failure:
+    """
+    A false predicate result carrying a `detail` explaining the failure,
+    which is added to the message of the resulting contract error.
+    """
+
+    __slots__ = ("detail",)
+
+    def __init__(self, detail):
+        self.detail = detail
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "Failure(%r)" % (self.detail,)
+
+def failure_message(description, check):
+    if isinstance(check, Failure):
+        return "%s: %s" % (description, check.detail)
+    return description
+
+decorator_sources = {}
+
+def get_function_source(func):
+    """
+    Return a description of the contract whose predicate is `func`, made
+    from the source code of the decorator in which `func` is defined.
+    """
+
+    import linecache
+
+    code = func.__code__
+    try:
+        lines = linecache.getlines(code.co_filename, func.__globals__)
+        sources = decorator_sources.get(code.co_filename)
+        if sources is None or sources[0] is not lines:
+            sources = decorator_sources[code.co_filename] = (lines, parse_decorators(lines))
+        return sources[1][code.co_firstlineno] + " failed"
+
+    except (SyntaxError, KeyError):
+        return str(func)
+
+def parse_decorators(lines):
+    """
+    Parse the source `lines` of a module, returning a dictionary mapping
+    each line number of every decorator to that decorator's source.
+    """
+
+    from ast import parse, walk
+    from textwrap import dedent
+
+    decorators = {}
+    for node in walk(parse("".join(lines))):
+        decorator_list = getattr(node, "decorator_list", ())
+        for i, decorator in enumerate(decorator_list):
+            first_line = decorator.lineno
+            last_line = getattr(decorator, "end_lineno", None)
+            if last_line is None:
+                if i + 1 < len(decorator_list):
+                    last_line = decorator_list[i + 1].lineno - 1
+                else:
+                    last_line = node.body[0].lineno - 2
+            last_line = max(first_line, last_line)
+            source = dedent("".join(lines[first_line - 1:last_line])).rstrip("\n")
+            for line in range(first_line, last_line + 1):
+                decorators[line] = source
+    return decorators
+
+lambda_sources = {}
+
+def get_lambda_node(func):
+    """
+    Return the `ast.Lambda` node defining the lambda `func`, or None if it
+    cannot be told apart from the other lambdas on its line of source.
+    """
+
+    import ast
+    import linecache
+
+    code = func.__code__
+    lines = linecache.getlines(code.co_filename, func.__globals__)
+    sources = lambda_sources.get(code.co_filename)
+    if sources is None or sources[0] is not lines:
+        lambdas = {}
+        try:
+            nodes = ast.walk(ast.parse("".join(lines)))
+        except SyntaxError:
+            nodes = ()
+        for node in nodes:
+            if isinstance(node, ast.Lambda):
+                lambdas.setdefault(node.lineno, []).append(node)
+        sources = lambda_sources[code.co_filename] = (lines, lambdas)
+
+    found = None
+    for node in sources[1].get(code.co_firstlineno, ()):
+        compiled = compile(ast.Expression(body=node), code.co_filename, "eval")
+        compiled = [const for const in compiled.co_consts if hasattr(const, "co_code")]
+        if compiled and same_code(compiled[0], code):
+            if found is not None:
+                return None
+            found = node
+    return found
+
+def same_code(code, other):
+    """
+    Return True if the code objects `code` and `other` have the same
+    bytecode, names and constants, comparing nested code objects in turn.
+    """
+
+    return code.co_code == other.co_code and code.co_names == other.co_names and \
+        code.co_varnames == other.co_varnames and \
+        same_constants(code.co_consts, other.co_consts)
+
+def same_constants(consts, others):
+    if len(consts) != len(others):
+        return False
+    for const, other in zip(consts, others):
+        if type(const) is not type(other):
+            return False
+        if hasattr(const, "co_code"):
+            if not same_code(const, other):
+                return False
+        elif isinstance(const, tuple):
+            if not same_constants(const, other):
+                return False
+        elif const != other:
+            return False
+    return True
+
+def inline_expression(func, names, fields):
+    """
+    Return the body of the lambda `func` as an expression in which its
+    parameters are replaced by the local variables in `names`, and the
+    attributes of its first parameter that are in `fields` by the local
+    variables holding them, or None if the lambda cannot safely be inlined.
+    """
+
+    import ast
+    from copy import deepcopy
+
+    code = func.__code__
+    if func.__name__ != "<lambda>" or func.__closure__ or func.__defaults__ or \
+       func.__kwdefaults__ or code.co_flags & (CO_VARARGS | CO_VARKEYWORDS | CO_COROUTINE) or \
+       code.co_kwonlyargcount or code.co_argcount != len(names):
+        return None
+    node = get_lambda_node(func)
+    if node is None:
+        return None
+
+    params = dict(zip(code.co_varnames, names))
+    first = code.co_varnames[0]
+    for child in ast.walk(node.body):
+        if isinstance(child, ast.arg) and child.arg in params:
+            return None
+        if isinstance(child, ast.Name) and (child.id.startswith("_dpc_") or
+                                            (child.id in params and
+                                             not isinstance(child.ctx, ast.Load))):
+            return None
+        if type(child).__name__ == "NamedExpr":
+            return None
+
+    class Inliner(ast.NodeTransformer):
+        def visit_Attribute(self, node):
+            if isinstance(node.value, ast.Name) and node.value.id == first and \
+               node.attr in fields and isinstance(node.ctx, ast.Load):
+                return ast.copy_location(ast.Name(id="_dpc_a_" + node.attr, ctx=ast.Load()), node)
+            return self.generic_visit(node)
+
+        def visit_Name(self, node):
+            if node.id in params:
+                return ast.copy_location(ast.Name(id=params[node.id], ctx=ast.Load()), node)
+            return node
+
+    return Inliner().visit(deepcopy(node.body))
+
+def compile_checks(conditions, post, fields, name):
+    """
+    Compile a function checking the conditions in `conditions`, in order,
+    with the bodies of as many of their lambda predicates as can be inlined
+    written into it, or return None if none of them can be.  Preconditions
+    are checked with `check(args, rargs)`, and postconditions with
+    `check(args, rargs, result, old)`.
+    """
+
+    import ast
+
+    scope = None
+    helpers, expressions, lines = [], {}, []
+    for index, condition in enumerate(conditions):
+        predicate = condition.predicate
+        if condition.instance:
+            names = ["_dpc_args[0]"]
+        elif post and condition.takes_old:
+            names = ["_dpc_rargs", "_dpc_result", "_dpc_old"]
+        elif post:
+            names = ["_dpc_rargs", "_dpc_result"]
+        else:
+            names = ["_dpc_rargs"]
+
+        expression = None
+        if scope is None or predicate.__globals__ is scope:
+            expression = inline_expression(predicate, [name.replace("[0]", "_0") for name in names],
+                                           fields if not condition.instance else ())
+        if expression is not None:
+            scope = predicate.__globals__
+            expressions["_dpc_e%d" % index] = expression
+            lines.append("        _dpc_check = _dpc_e%d" % index)
+        else:
+            helpers.append("_dpc_p%d" % index)
+            lines.append("        _dpc_check = _dpc_p%d(%s)" % (index, ", ".join(names)))
+        helpers.append("_dpc_c%d" % index)
+        lines.append("        if not _dpc_check:")
+        lines.append("            raise _dpc_error(_dpc_failure(_dpc_c%d.description, _dpc_check))"
+                     % index)
+    if not expressions:
+        return None
+
+    used = set()
+    for expression in expressions.values():
+        used.update(node.id[7:] for node in ast.walk(expression)
+                    if isinstance(node, ast.Name) and node.id.startswith("_dpc_a_"))
+    prologue = ["        _dpc_a_%s = _dpc_rargs[%d]" % (field, fields.index(field))
+                for field in sorted(used)]
+    if any(condition.instance for condition in conditions):
+        prologue.append("        _dpc_args_0 = _dpc_args[0]")
+
+    # Every name the generated code introduces starts with `_dpc_`, which
+    # `inline_expression` rejects in predicates, so none can shadow theirs.
+    source = "\n".join(["def _dpc_make(_dpc_error, _dpc_failure, %s):" % ", ".join(helpers),
+                        "    def _dpc_check(_dpc_args, _dpc_rargs%s):" %
+                        (", _dpc_result, _dpc_old" if post else "")] +
+                       prologue + lines + ["    return _dpc_check"])
+
+    class Splicer(ast.NodeTransformer):
+        def visit_Name(self, node):
+            return expressions.get(node.id, node)
+
+    tree = ast.fix_missing_locations(Splicer().visit(ast.parse(source)))
+    module = compile(tree, "<inlined contracts of %s>" % name, "exec")
+    make = FunctionType([const for const in module.co_consts if hasattr(const, "co_code")][0],
+                        scope)
+    values = dict(("_dpc_p%d" % index, condition.predicate) for index, condition in
+                  enumerate(conditions))
+    values.update(("_dpc_c%d" % index, condition) for index, condition in enumerate(conditions))
+    return make(PostconditionError if post else PreconditionError, failure_message,
+                *[values[helper] for helper in helpers])
+
+inlining = False
+
+def set_inlining(enabled):
+    """
+    Compile the lambda predicates of functions called for the first time
+    from now on into a single checking function per function, if `enabled`.
+    """
+
+    global inlining
+    inlining = enabled
+
+CO_VARARGS = 0x04
+CO_VARKEYWORDS = 0x08
+CO_COROUTINE = 0x80
+
+def isfunction(value):
+    return isinstance(value, FunctionType)
+
+def iscoroutinefunction(func):
+    code = getattr(func, "__code__", None)
+    return code is not None and bool(code.co_flags & CO_COROUTINE)
+
+def getfullargspec(func):
+    """
+    Return the same tuple as `inspect.getfullargspec`, read straight from
+    the code object of `func` if it has one, without importing `inspect`.
+    """
+
+    code = getattr(func, "__code__", None)
+    if code is None:
+        from inspect import getfullargspec
+
+        return tuple(getfullargspec(func))
+
+    names = code.co_varnames
+    end = code.co_argcount + code.co_kwonlyargcount
+    vargs = varkw = None
+    if code.co_flags & CO_VARARGS:
+        vargs = names[end]
+        end += 1
+    if code.co_flags & CO_VARKEYWORDS:
+        varkw = names[end]
+    return (list(names[:code.co_argcount]), vargs, varkw, func.__defaults__,
+            list(names[code.co_argcount:code.co_argcount + code.co_kwonlyargcount]),
+            func.__kwdefaults__, func.__annotations__)
+
+def get_wrapped_func(func):
+    while hasattr(func, '__contract_wrapped_func__'):
+        func = func.__contract_wrapped_func__
+    return func
+
+def signature_shape(func):
+    """
+    Return what an argument binder needs to know about the signature of
+    `func`, apart from its name and default values.
+    """
+
+    named, vargs, varkw, defs, kwonly, kwonlydefs, _ = getfullargspec(func)
+    kwonlydefs = kwonlydefs or {}
+    posonly = getattr(func.__code__, "co_posonlyargcount", 0)
+    return (tuple(named), posonly, vargs, varkw, len(defs or ()), tuple(kwonly),
+            tuple(name in kwonlydefs for name in kwonly))
+
+@lru_cache(maxsize=256)
+def binder_code(shape):
+    """
+    Generate and compile the code of an argument binder and unbinder for
+    functions with the signature `shape`, along with their `Args` class.
+    Functions with the same shape share both.
+    """
+
+    from collections import namedtuple
+
+    named, posonly, vargs, varkw, ndefaults, kwonly, kwdefaulted = shape
+
+    fields = list(named)
+    if vargs:
+        fields.append(vargs)
+    fields.extend(kwonly)
+    if varkw:
+        fields.append(varkw)
+
+    lines = ["def bind(*args, **kwargs):",
+             "    n = len(args)"]
+
+    if not vargs:
+        lines.extend(["    if n > %d:" % len(named),
+                      "        raise TypeError(\"%%s takes %d positional arguments but %%d were given\" %% (name, n))"
+                      % len(named)])
+
+    first_default = len(named) - ndefaults
+    for i, arg in enumerate(named):
+        lines.extend(["    if n > %d:" % i,
+                      "        _%d = args[%d]" % (i, i)])
+        if i >= posonly:
+            lines.extend(["        if %r in kwargs:" % arg,
+                          "            raise TypeError(\"%%s got multiple values for argument '%s'\" %% name)"
+                          % arg,
+                          "    elif %r in kwargs:" % arg,
+                          "        _%d = kwargs.pop(%r)" % (i, arg)])
+        lines.append("    else:")
+        if i >= first_default:
+            lines.append("        _%d = default_%d" % (i, i))
+        else:
+            lines.append("        raise TypeError(\"%%s missing required positional argument: '%s'\" %% name)"
+                         % arg)
+
+    values = ["_%d" % i for i in range(len(named))]
+    if vargs:
+        lines.append("    _v = args[%d:]" % len(named))
+        values.append("_v")
+
+    for i, (arg, defaulted) in enumerate(zip(kwonly, kwdefaulted)):
+        if defaulted:
+            lines.append("    _k%d = kwargs.pop(%r, kwdefault_%d)" % (i, arg, i))
+        else:
+            lines.extend(["    if %r not in kwargs:" % arg,
+                          "        raise TypeError(\"%%s missing required keyword-only argument: '%s'\" %% name)"
+                          % arg,
+                          "    _k%d = kwargs.pop(%r)" % (i, arg)])
+        values.append("_k%d" % i)
+
+    if varkw:
+        values.append("kwargs")
+    else:
+        lines.extend(["    if kwargs:",
+                      "        raise TypeError(\"%s got an unexpected keyword argument '%s'\" % (name, next(iter(kwargs))))"])
+    lines.append("    return new(Args, (%s))" % "".join(v + ", " for v in values))
+
+    arguments = ["a[%d]" % i for i in range(len(named))]
+    if vargs:
+        arguments.append("*a[%d]" % len(named))
+    offset = len(named) + (1 if vargs else 0)
+    arguments.extend("%s=a[%d]" % (arg, offset + i) for i, arg in enumerate(kwonly))
+    if varkw:
+        arguments.append("**a[%d]" % (len(fields) - 1))
+    lines.extend(["def unbind(func, a):",
+                  "    return func(%s)" % ", ".join(arguments)])
+
+    Args = namedtuple("Args", fields)
+    Args.__reduce__ = reduce_args
+    return compile("\n".join(lines), "<dpcontracts binder>", "exec"), Args
+
+def compile_binder(func):
+    """
+    Compile an argument binder for `func`.
+
+    The binder is a generated function accepting the same arguments as
+    `func` and returning an `Args` tuple, the class of which is created
+    once per signature rather than once per call.  Extra keyword arguments
+    are collected in a single dict, named like the `**` parameter of
+    `func`.  The binder's `unbind` attribute is a function calling a given
+    function with the arguments in an `Args` tuple.
+    """
+
+    named, _, _, defs, kwonly, kwonlydefs, _ = getfullargspec(func)
+    defs = defs or ()
+    kwonlydefs = kwonlydefs or {}
+    code, Args = binder_code(signature_shape(func))
+
+    namespace = {"Args": Args, "new": tuple.__new__, "TypeError": TypeError,
+                 "name": func.__name__}
+    first_default = len(named) - len(defs)
+    for i in range(first_default, len(named)):
+        namespace["default_%d" % i] = defs[i - first_default]
+    for i, arg in enumerate(kwonly):
+        if arg in kwonlydefs:
+            namespace["kwdefault_%d" % i] = kwonlydefs[arg]
+
+    exec(code, namespace)
+    bind = namespace["bind"]
+    bind.Args = Args
+    bind.unbind = namespace["unbind"]
+    return bind
+
+_binders = WeakKeyDictionary()
+
+def unbind(binder, func, rargs):
+    """
+    Call `func` with the arguments in `rargs`, as returned by a transform.
+    Only an `Args` tuple of `binder` is passed on by position; any other
+    named tuple is passed on by field name.
+    """
+
+    if type(rargs) is binder.Args:
+        return binder.unbind(func, rargs)
+    return func(**rargs._asdict())
+
+def get_binder(func):
+    """
+    Return the argument binder for `func`, compiling it on first use.
+    """
+
+    func = get_wrapped_func(func)
+    binder = _binders.get(func)
+    if binder is None:
+        binder = _binders[func] = compile_binder(func)
+    return binder
+
+def build_call(func, *args, **kwargs):
+    """
+    Build an argument tuple whose attributes are the arguments that function
+    `func` would receive given positional arguments `args` and keyword
+    arguments `kwargs`.
+    """
+
+    return get_binder(func)(*args, **kwargs)
+
+@lru_cache(maxsize=256)
+def tuple_class(name, fields):
+    from collections import namedtuple
+
+    cls = namedtuple(name, fields)
+    cls.__reduce__ = reduce_args
+    return cls
+
+def reduce_args(args):
+    """
+    Pickle argument tuples, the classes of which can't be found by name,
+    as their field names and values.
+    """
+
+    return (rebuild_args, (type(args).__name__, args._fields, tuple(args)))
+
+def rebuild_args(name, fields, values):
+    return tuple.__new__(tuple_class(name, fields), values)
+
+def tuple_of_dict(dictionary, name="Args"):
+    assert isinstance(dictionary, dict), "dictionary must be a dict instance"
+    return tuple_class(name, tuple(dictionary.keys()))(**dictionary)
+
+def arg_count(func):
+    named, vargs, _, defs, kwonly, kwonlydefs, _ = getfullargspec(func)
+    return len(named) + len(kwonly) + (1 if vargs else 0)
+
+class ContractProfiler:
+    """
+    Collects call counts, outcomes and timings for every contract checked
+    while it is installed with `set_profiler`.  Predicate timings are keyed
+    by the contracted function and the contract's description; the time
+    spent binding arguments, running preservers and running transformers
+    is recorded separately as overhead.
+    """
+
+    samples = 1024
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard everything recorded so far."""
+
+        with self.lock:
+            self.contracts = {}
+            self.overhead = {}
+
+    def record(self, function, description, elapsed, passed):
+        with self.lock:
+            stats = self.contracts.get((function, description))
+            if stats is None:
+                stats = self.contracts[function, description] = [0, 0, 0.0, []]
+            stats[0] += 1
+            stats[1] += 1 if passed else 0
+            stats[2] += elapsed
+            if len(stats[3]) < self.samples:
+                stats[3].append(elapsed)
+            else:
+                index = randrange(stats[0])
+                if index < self.samples:
+                    stats[3][index] = elapsed
+
+    def record_overhead(self, function, kind, elapsed):
+        with self.lock:
+            stats = self.overhead.get((function, kind))
+            if stats is None:
+                stats = self.overhead[function, kind] = [0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def snapshot(self):
+        """
+        Return what has been recorded as a dictionary of plain values, with
+        times in seconds and the most expensive entries first.
+        """
+
+        def percentile(samples, fraction):
+            return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+        with self.lock:
+            contracts = []
+            for (function, description), (calls, passed, total, samples) in self.contracts.items():
+                samples = sorted(samples)
+                contracts.append({"function": function, "description": description,
+                                  "calls": calls, "passed": passed, "failed": calls - passed,
+                                  "total": total, "mean": total / calls,
+                                  "p50": percentile(samples, 0.50),
+                                  "p90": percentile(samples, 0.90),
+                                  "p99": percentile(samples, 0.99)})
+            overhead = [{"function": function, "kind": kind, "calls": calls,
+                         "total": total, "mean": total / calls}
+                        for (function, kind), (calls, total) in self.overhead.items()]
+
+        contracts.sort(key=lambda entry: entry["total"], reverse=True)
+        overhead.sort(key=lambda entry: entry["total"], reverse=True)
+        return {"contracts": contracts, "overhead": overhead}
+
+    def report(self, format="text"):
+        """
+        Return a report of what has been recorded, either as a text table
+        or, if `format` is "json", as a JSON document.
+        """
+
+        snapshot = self.snapshot()
+        if format == "json":
+            from json import dumps
+
+            return dumps(snapshot, indent=2, sort_keys=True)
+        assert format == "text", "reports are either text or json"
+
+        lines = ["%8s %8s %8s %12s %12s %12s  %s" % ("calls", "passed", "failed", "total(us)",
+                                                   "mean(us)", "p99(us)", "contract")]
+        for entry in snapshot["contracts"]:
+            lines.append("%8d %8d %8d %12.1f %12.2f %12.2f  %s: %s" % (
+                entry["calls"], entry["passed"], entry["failed"], entry["total"] * 1e6,
+                entry["mean"] * 1e6, entry["p99"] * 1e6, entry["function"],
+                entry["description"].split("\n")[0]))
+        lines.append("")
+        lines.append("%8s %12s %12s  %s" % ("calls", "total(us)", "mean(us)", "overhead"))
+        for entry in snapshot["overhead"]:
+            lines.append("%8d %12.1f %12.2f  %s: %s" % (
+                entry["calls"], entry["total"] * 1e6, entry["mean"] * 1e6,
+                entry["function"], entry["kind"]))
+        return "\n".join(lines)
+
+active_profiler = None
+
+def set_profiler(profiler):
+    """
+    Install `profiler`, a `ContractProfiler`, to record every contract
+    checked from now on, or stop recording if `profiler` is None.
+    """
+
+    global active_profiler
+    active_profiler = profiler
+
+def profiled(function, condition, *arguments):
+    """
+    Call the predicate of `condition` with `arguments`, recording the time
+    taken and the outcome with the active profiler.
+    """
+
+    passed = False
+    start = perf_counter()
+    try:
+        check = condition.predicate(*arguments)
+        passed = bool(check)
+        return check
+    finally:
+        active_profiler.record(function, condition.description, perf_counter() - start, passed)
+
+def function_name(func):
+    return "%s.%s" % (func.__module__, func.__qualname__)
+
+class Condition:
+    """
+    A single contract: a description, a predicate, and the points at which
+    the predicate is checked.
+    """
+
+    __slots__ = ("given_description", "predicate", "precondition", "postcondition",
+                 "instance", "takes_old", "sampler", "executor", "deferred", "awaited",
+                 "transformer", "typed")
+
+    def __init__(self, description, predicate, precondition, postcondition, instance,
+                 sampler=None, executor=None, deferred=False, transformer=False, typed=False):
+        self.given_description = description
+        self.predicate = predicate
+        self.precondition = precondition
+        self.postcondition = postcondition
+        self.instance = instance
+        self.takes_old = postcondition and not instance and arg_count(predicate) == 3
+        self.sampler = sampler
+        self.executor = executor
+        self.deferred = deferred
+        self.awaited = executor is not None or iscoroutinefunction(predicate)
+        self.transformer = transformer
+        self.typed = typed
+
+    @property
+    def category(self):
+        """
+        The category by which the contract can be suppressed: "pre", "post",
+        "invariant" or "types", or None for transforms, which cannot be.
+        """
+
+        if self.transformer:
+            return None
+        if self.typed:
+            return "types"
+        if self.instance:
+            return "invariant"
+        return "pre" if self.precondition else "post"
+
+    @property
+    def description(self):
+        """
+        The contract's description, generated from the source of the
+        predicate when it is first needed if none was given.
+        """
+
+        if self.given_description is None:
+            self.given_description = get_function_source(self.predicate)
+        return self.given_description
+
+class TimedCondition(Condition):
+    """
+    A copy of a condition whose predicate is timed by a `BudgetSampler`,
+    described as the original condition is.
+    """
+
+    __slots__ = ("original",)
+
+    @property
+    def description(self):
+        return self.original.description
+
+missing = object()
+
+class Memo:
+    """
+    The results of calls to a contracted function that passed all of its
+    contracts, keyed on the arguments of the calls.  At most `maxsize`
+    results are kept, the least recently used being discarded first, each
+    for at most `ttl` seconds.  Calls with unhashable arguments are never
+    remembered.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        assert maxsize is None or maxsize > 0, "maxsize must be positive"
+        assert ttl is None or ttl > 0, "ttl must be positive"
+        self.maxsize = maxsize
+        self.ttl = ttl
+        from collections import OrderedDict
+
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the remembered result for `key`, or `missing`.
+        """
+
+        with self.lock:
+            try:
+                entry = self.entries.get(key)
+            except TypeError:
+                entry = None
+            if entry is not None and entry[1] is not None and monotonic() > entry[1]:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return missing
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        expires = None if self.ttl is None else monotonic() + self.ttl
+        with self.lock:
+            try:
+                self.entries[key] = (result, expires)
+            except TypeError:
+                return
+            self.entries.move_to_end(key)
+            if self.maxsize is not None and len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+def memoized(maxsize=128, ttl=None):
+    """
+    Remember the results of calls to a function that passed all of its
+    contracts, so that calling it again with equal arguments skips both the
+    function and its contracts.  The function must be pure.  See `Memo` for
+    `maxsize` and `ttl`; the `Memo` is available as the `memo` attribute of
+    the decorated function.
+    """
+
+    def func(f):
+        assert isfunction(f), "only functions can be memoized"
+        f = add_conditions(f, [], memo=Memo(maxsize, ttl))
+        f.memo = f.__contracts__.memo
+        return f
+    return func
+
+def recursive(every=None):
+    """
+    Check the contracts of a recursive function only on its outermost call,
+    or, if `every` is given, only on calls at every `every`th depth of
+    recursion, the outermost being at depth 0.  Transforms are still
+    applied at every depth.  The depth is tracked separately for each thread
+    and asynchronous task.
+    """
+
+    assert every is None or (isinstance(every, int) and every > 0), \
+        "recursion depths must be checked every positive number of calls"
+
+    def func(f):
+        assert isfunction(f), "only functions can be recursive"
+        return add_conditions(f, [], recursion=every or 0)
+    return func
+
+class Contracts:
+    """
+    The conditions checked by a single contract wrapper around `func`,
+    outermost first, along with the options that apply to all of them: the
+    sampling policy for conditions that have none of their own, and whether
+    invariants are checked on calls nested within another call on the same
+    instance, and the `ChangeTracker` letting invariants be skipped on
+    instances that have not changed since they were last checked.  The
+    preservers building the old values passed to postconditions are kept
+    innermost first, so that outer ones take precedence.  The `Memo`, if
+    any, holds the results of calls that passed all of the conditions.
+    Conditions are checked on recursive calls to `func` at every
+    `recursion`th depth, or only on the outermost call if `recursion` is 0.
+    """
+
+    __slots__ = ("func", "conditions", "sampler", "nested", "tracker", "preservers", "memo",
+                 "recursion", "wrapper")
+
+    def __init__(self, func, conditions, sampler=None, nested=True, tracker=None, preservers=(),
+                 memo=None, recursion=1):
+        self.func = func
+        self.conditions = conditions
+        self.sampler = sampler
+        self.nested = nested
+        self.tracker = tracker
+        self.preservers = preservers
+        self.memo = memo
+        self.recursion = recursion
+        self.wrapper = None
+
+    def replace(self, **changes):
+        """
+        Return a copy of these contracts with the attributes in `changes`
+        replaced, to be given a new wrapper.
+        """
+
+        contracts = Contracts(self.func, self.conditions)
+        for name in self.__slots__:
+            if name != "wrapper":
+                setattr(contracts, name, changes.get(name, getattr(self, name)))
+        return contracts
+
+class Plan:
+    """
+    The conditions a contract wrapper checks on a call, split into those
+    checked before and after the call, with their sampling policies.
+    Transforms are kept among both, in place, and are never sampled.  A
+    plan chosen by sampling keeps the `BudgetSampler`s to be told the time
+    taken by the call, with the conditions they selected.
+    """
+
+    __slots__ = ("conditions", "pres", "posts", "plain_pres", "plain_posts",
+                 "invariant_pres", "invariant_posts", "uses_args", "takes_old",
+                 "transforms", "sampler", "samplers", "sampleable", "budgets", "nested_plan",
+                 "suppressed_plans", "sampled_plans", "inline_pres", "inline_posts")
+
+    def __init__(self, conditions, sampler=None):
+        self.conditions = conditions
+        self.sampler = sampler
+        self.pres = [condition for condition in conditions if condition.precondition]
+        self.posts = [condition for condition in reversed(conditions) if condition.postcondition]
+        self.plain_pres = [condition for condition in self.pres if not condition.instance]
+        self.plain_posts = [condition for condition in self.posts if not condition.instance]
+        self.invariant_pres = len(self.plain_pres) < len(self.pres)
+        self.invariant_posts = len(self.plain_posts) < len(self.posts)
+        self.uses_args = not all(condition.instance for condition in conditions)
+        self.takes_old = any(condition.takes_old for condition in self.posts)
+        self.transforms = any(condition.transformer for condition in conditions)
+        self.sampleable = [(condition.postcondition or condition.instance) and not condition.transformer
+                           for condition in conditions]
+        self.samplers = [condition.sampler or (sampler if sampleable else None)
+                         for condition, sampleable in zip(conditions, self.sampleable)]
+        if all(sampler is None for sampler in self.samplers):
+            self.samplers = None
+        self.sampleable = any(self.sampleable)
+        self.budgets = None
+        self.nested_plan = None
+        self.suppressed_plans = None
+        self.sampled_plans = None
+        self.inline_pres = self.inline_posts = None
+
+    def sample(self):
+        """
+        Return the plan for the conditions selected by their sampling
+        policies on this call, or None if none of them are.
+        """
+
+        samplers = self.samplers or [None] * len(self.conditions)
+        kept, budgets = [], []
+        for condition, sampler in zip(self.conditions, samplers):
+            if sampler is None and (condition.postcondition or condition.instance) and \
+               not condition.transformer:
+                sampler = default_sampler
+            if isinstance(sampler, BudgetSampler):
+                selected = sampler.select(condition)
+                if selected is not None:
+                    kept.append(selected)
+                    budgets.append((sampler, condition))
+            elif sampler is None or sampler():
+                kept.append(condition)
+
+        if self.sampled_plans is None:
+            self.sampled_plans = {}
+        kept = tuple(kept)
+        plan = self.sampled_plans.get(kept)
+        if plan is None:
+            plan = self.sampled_plans[kept] = make_plan(list(kept)) or False
+            if plan and budgets:
+                plan.budgets = budgets
+        return plan or None
+
+    def nested(self):
+        """
+        Return the plan for a call nested within another call on the same
+        instance, which checks no invariants, or None if there is nothing
+        left to check.
+        """
+
+        if self.nested_plan is None:
+            self.nested_plan = make_plan([condition for condition in self.conditions
+                                          if not condition.instance]) or False
+        return self.nested_plan or None
+
+    def suppress(self, categories):
+        """
+        Return the plan for a call on which the contracts in `categories`,
+        a frozenset of categories, are suppressed, or None if there is
+        nothing left to check.
+        """
+
+        if self.suppressed_plans is None:
+            self.suppressed_plans = {}
+        plan = self.suppressed_plans.get(categories)
+        if plan is None:
+            plan = self.suppressed_plans[categories] = make_plan(
+                [condition for condition in self.conditions
+                 if condition.category not in categories], self.sampler) or False
+        return plan or None
+
+def make_plan(conditions, sampler=None):
+    return Plan(conditions, sampler) if conditions else None
+
+def record_call(budgets, elapsed):
+    for sampler, condition in budgets:
+        sampler.record_call(condition, elapsed)
+
+active_instances = OwnedVar("active_instances", default=frozenset())
+
+CATEGORIES = ("pre", "post", "invariant", "types")
+
+# The categories of contracts suppressed in the current context, paired with
+# the value to restore on leaving the innermost suppressed scope, or None.
+suppression = ContextVar("suppressed_categories", default=None)
+
+class suppressed:
+    """
+    Suppress the contracts of the given `categories`, any of "pre", "post",
+    "invariant" and "types", or of all of them if none are given, within a
+    `with` block or in calls to a decorated function, and anything they
+    call.  Transforms are still applied.  Suppression is local to the
+    thread or asynchronous task it is entered in, so one instance can be
+    shared between them.
+    """
+
+    def __init__(self, *categories):
+        for category in categories:
+            assert category in CATEGORIES, "unknown contract category: %r" % (category,)
+        self.categories = frozenset(categories or CATEGORIES)
+
+    def enter(self):
+        active = suppression.get()
+        categories = self.categories if active is None else active[0] | self.categories
+        return suppression.set((categories, active))
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, *exc_info):
+        suppression.set(suppression.get()[1])
+
+    def __call__(self, f):
+        if iscoroutinefunction(f):
+            @wraps(f)
+            async def inner(*args, **kwargs):
+                token = self.enter()
+                try:
+                    return await f(*args, **kwargs)
+                finally:
+                    suppression.reset(token)
+        else:
+            @wraps(f)
+            def inner(*args, **kwargs):
+                token = self.enter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    suppression.reset(token)
+        return inner
+
+def get_contracts(f):
+    """
+    Return the `Contracts` of `f` if `f` is a contract wrapper, or None.
+    """
+
+    contracts = getattr(f, "__contracts__", None)
+    if contracts is not None and contracts.wrapper is f:
+        return contracts
+    return None
+
+def add_conditions(f, conditions, **options):
+    """
+    Return a contract wrapper replacing `f` that checks `conditions`, given
+    outermost first, before any conditions `f` already checks.
+    """
+
+    contracts = get_contracts(f)
+    if contracts is not None:
+        contracts = contracts.replace(conditions=list(conditions) + contracts.conditions, **options)
+    else:
+        contracts = Contracts(f, list(conditions), **options)
+    return contract_wrapper(f, contracts)
+
+def postcondition_arguments(condition, args, rargs, result, old):
+    if condition.instance:
+        return (args[0],)
+    if condition.takes_old:
+        return (rargs, result, old)
+    return (rargs, result)
+
+async def evaluate(function, condition, arguments):
+    """
+    Await the predicate of `condition` called with `arguments`, running it in
+    its executor unless it is a coroutine function.
+    """
+
+    import asyncio
+
+    profiler = active_profiler
+    passed = False
+    start = perf_counter()
+    try:
+        if iscoroutinefunction(condition.predicate):
+            check = await condition.predicate(*arguments)
+        else:
+            executor = None if condition.executor is True else condition.executor
+            loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)()
+            check = await loop.run_in_executor(executor, condition.predicate, *arguments)
+        passed = bool(check)
+        return check
+    finally:
+        if profiler is not None:
+            profiler.record(function, condition.description, perf_counter() - start, passed)
+
+async def check_awaited(function, checks, error):
+    """
+    Check each condition in `checks`, a list of `(condition, arguments)`
+    pairs, raising `error` for the first that fails.  Predicates that must
+    be awaited are run concurrently, once all of the others have passed.
+    """
+
+    awaited = []
+    for condition, arguments in checks:
+        if condition.awaited:
+            awaited.append((condition, arguments))
+            continue
+        if active_profiler is None:
+            check = condition.predicate(*arguments)
+        else:
+            check = profiled(function, condition, *arguments)
+        if not check:
+            raise error(failure_message(condition.description, check))
+
+    if len(awaited) == 1:
+        results = [await evaluate(function, *awaited[0])]
+    elif awaited:
+        import asyncio
+
+        results = await asyncio.gather(*[evaluate(function, condition, arguments)
+                                         for condition, arguments in awaited],
+                                       return_exceptions=True)
+    else:
+        return
+
+    for (condition, _), check in zip(awaited, results):
+        if isinstance(check, BaseException):
+            raise check
+        if not check:
+            raise error(failure_message(condition.description, check))
+
+def report_violation(error):
+    """
+    The default violation handler, reporting `error` as an uncaught
+    exception would be.  Errors other than violations raised while checking
+    deferred postconditions, such as predicates that cannot be pickled for
+    a process pool, are always reported this way.
+    """
+
+    sys.excepthook(type(error), error, error.__traceback__)
+
+def handle_deferred_error(error):
+    if isinstance(error, PostconditionError):
+        violation_handler(error)
+    else:
+        report_violation(error)
+
+violation_handler = report_violation
+
+def set_violation_handler(handler):
+    """
+    Set the function called with the exception raised by each failing
+    deferred postcondition, or restore the default handler if `handler` is
+    None.
+    """
+
+    global violation_handler
+
+    assert handler is None or callable(handler), "violation handlers must be callable"
+    violation_handler = handler or report_violation
+
+background_checks = set()
+
+def defer_checks(function, checks):
+    """
+    Check the deferred postconditions in `checks` in a background task,
+    passing any violation to the violation handler.
+    """
+
+    import asyncio
+
+    async def check():
+        try:
+            await check_awaited(function, checks, PostconditionError)
+        except Exception as error:
+            handle_deferred_error(error)
+
+    task = asyncio.ensure_future(check())
+    background_checks.add(task)
+    task.add_done_callback(background_checks.discard)
+
+def run_checks(function, checks):
+    """
+    Check each condition in `checks`, a list of `(condition, arguments)`
+    pairs, raising `PostconditionError` for the first that fails.
+    """
+
+    for condition, arguments in checks:
+        if active_profiler is None:
+            check = condition.predicate(*arguments)
+        else:
+            check = profiled(function, condition, *arguments)
+        if not check:
+            raise PostconditionError(failure_message(condition.description, check))
+
+POLICIES = ("block", "drop", "inline")
+
+class DeferredChecker:
+    """
+    Checks the deferred postconditions of ordinary functions on background
+    threads, fed by a queue holding at most `maxsize` calls.  When the queue
+    is full, the policy decides whether the caller blocks until there is
+    room, the call's checks are dropped, or they are run by the caller.
+    Given an `executor`, such as a process pool, the threads hand the checks
+    to it instead of running them themselves; a process pool can only run
+    predicates that can be pickled, so not lambdas.
+    """
+
+    def __init__(self, maxsize=1024, workers=1, policy="block", executor=None):
+        assert policy in POLICIES, "policy must be one of %s" % ", ".join(POLICIES)
+        assert workers > 0, "there must be at least one worker"
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = policy
+        self.executor = executor
+        self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        # A process forked from the one that started the workers has none of
+        # them running, and its queue and lock may have been in use when it
+        # was forked, so it starts afresh, leaving the calls queued before the
+        # fork to be checked by the parent.
+        from queue import Queue
+
+        self.queue = Queue(self.maxsize)
+        self.threads = []
+        self.lock = Lock()
+        self.pid = getpid()
+
+    def start(self):
+        if self.pid != getpid():
+            self.reset()
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = Thread(target=self.work, name="dpcontracts-deferred", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def work(self):
+        while True:
+            function, checks = self.queue.get()
+            try:
+                if self.executor is None:
+                    run_checks(function, checks)
+                else:
+                    self.executor.submit(run_checks, function, checks).result()
+            except Exception as error:
+                handle_deferred_error(error)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, function, checks):
+        """
+        Queue the postconditions in `checks` of a call to `function`.
+        """
+
+        if len(self.threads) < self.workers or self.pid != getpid():
+            self.start()
+
+        if self.policy == "block":
+            self.queue.put((function, checks))
+            return
+
+        from queue import Full
+
+        try:
+            self.queue.put_nowait((function, checks))
+        except Full:
+            if self.policy == "drop":
+                with self.lock:
+                    self.dropped += 1
+                return
+            try:
+                run_checks(function, checks)
+            except Exception as error:
+                handle_deferred_error(error)
+
+    def join(self):
+        """
+        Wait until every queued call has been checked.
+        """
+
+        self.queue.join()
+
+deferred_checker = None
+
+def set_deferred_checker(checker):
+    """
+    Set the `DeferredChecker` used for the deferred postconditions of
+    ordinary functions, or go back to a default one if `checker` is None.
+    """
+
+    global deferred_checker
+
+    assert checker is None or isinstance(checker, DeferredChecker), \
+        "deferred checkers must be DeferredChecker instances"
+    deferred_checker = checker
+
+def get_deferred_checker():
+    global deferred_checker
+
+    if deferred_checker is None:
+        deferred_checker = DeferredChecker()
+    return deferred_checker
+
+def contract_wrapper(f, contracts):
+    """
+    Build the wrapper checking `contracts`, which replaces `f`.
+
+    However many conditions are stacked, arguments are bound once, all of the
+    preconditions are checked outermost first, the function is called, and
+    all of the postconditions are checked innermost first.
+    """
+
+    func = contracts.func
+    wrapped = get_wrapped_func(func)
+    module = wrapped.__module__
+    conditions = contracts.conditions
+    memo = contracts.memo
+    track_nested = not contracts.nested and any(c.instance for c in conditions)
+    tracker = contracts.tracker
+    preservers = contracts.preservers
+    recursion = contracts.recursion
+    if recursion != 1:
+        depth = OwnedVar("recursion_depth", default=0)
+
+    name = function_name(wrapped)
+
+    def check_preconditions(pres, args, rargs):
+        for condition in pres:
+            argument = args[0] if condition.instance else rargs
+            if active_profiler is None:
+                check = condition.predicate(argument)
+            else:
+                check = profiled(name, condition, argument)
+            if not check:
+                raise PreconditionError(failure_message(condition.description, check))
+
+    def profiled_bind(args, kwargs):
+        start = perf_counter()
+        try:
+            return binder(*args, **kwargs)
+        finally:
+            active_profiler.record_overhead(name, "bind", perf_counter() - start)
+
+    def preserve_values(rargs):
+        profiler = active_profiler
+        if profiler is not None:
+            start = perf_counter()
+        preserved_values = {}
+        for preserver in preservers:
+            preserved_values.update(preserver(rargs))
+        old = tuple_of_dict(preserved_values)
+        if profiler is not None:
+            profiler.record_overhead(name, "preserve", perf_counter() - start)
+        return old
+
+    def check_postconditions(posts, args, rargs, result, old):
+        for condition in posts:
+            if condition.instance:
+                arguments = (args[0],)
+            elif condition.takes_old:
+                arguments = (rargs, result, old)
+            else:
+                arguments = (rargs, result)
+            if active_profiler is None:
+                check = condition.predicate(*arguments)
+            else:
+                check = profiled(name, condition, *arguments)
+            if not check:
+                raise PostconditionError(failure_message(condition.description, check))
+
+    # The argument binder and the plans for each level are only built on the
+    # first call, as many decorated functions are never called at all.
+    binder = plans = memo_key = None
+
+    def install():
+        nonlocal binder, plans, memo_key
+        if memo is not None or not all(condition.instance for condition in conditions):
+            binder = get_binder(wrapped)
+        if memo is not None and getfullargspec(wrapped)[2]:
+            memo_key = lambda rargs: (rargs[:-1], frozenset(rargs[-1].items()))
+        else:
+            memo_key = lambda rargs: rargs
+        plans = [make_plan([c for c in conditions if c.transformer]),
+                 make_plan([c for c in conditions if c.precondition and not c.instance],
+                           contracts.sampler),
+                 make_plan(conditions, contracts.sampler)]
+        if inlining and tracker is None and not awaiting and not deferring:
+            fields = list(binder.Args._fields) if binder is not None else []
+            for plan in plans:
+                if plan is not None and plan.samplers is None and not plan.transforms:
+                    plan.inline_pres = compile_checks(plan.pres, False, fields, name)
+                    plan.inline_posts = compile_checks(plan.posts, True, fields, name)
+        return plans
+
+    def select_plan():
+        level = level_cache.get(module)
+        current = (plans or install())[level if level is not None else resolve_level(module)]
+        scope = suppression.get()
+        if scope is not None and current is not None:
+            current = current.suppress(scope[0])
+        if current is not None and (current.samplers is not None or
+                                    (default_sampler is not None and current.sampleable)):
+            current = current.sample()
+        return current
+
+    awaiting = any(condition.awaited or condition.deferred for condition in conditions)
+    deferring = any(condition.deferred for condition in conditions)
+    assert iscoroutinefunction(func) or not any(condition.awaited for condition in conditions), \
+        "awaited conditions can only be used on coroutine functions"
+
+    def apply_transform(condition, rargs):
+        if active_profiler is None:
+            return condition.predicate(rargs)
+        start = perf_counter()
+        try:
+            return condition.predicate(rargs)
+        finally:
+            active_profiler.record_overhead(name, "transform", perf_counter() - start)
+
+    def check_transforming_preconditions(pres, args, rargs):
+        history = []
+        for condition in pres:
+            if condition.transformer:
+                history.append(rargs)
+                rargs = apply_transform(condition, rargs)
+                continue
+            argument = args[0] if condition.instance else rargs
+            if active_profiler is None:
+                check = condition.predicate(argument)
+            else:
+                check = profiled(name, condition, argument)
+            if not check:
+                raise PreconditionError(failure_message(condition.description, check))
+        return rargs, history
+
+    def staged_postconditions(posts, args, rargs, history, result, old):
+        # Postconditions outside a transform see the arguments as they were
+        # before it, so walking outwards undoes the transforms in turn.
+        immediate, deferred = [], []
+        for condition in posts:
+            if condition.transformer:
+                rargs = history.pop()
+                continue
+            arguments = postcondition_arguments(condition, args, rargs, result, old)
+            (deferred if condition.deferred else immediate).append((condition, arguments))
+        return immediate, deferred
+
+    def check_staged_postconditions(posts, args, rargs, history, result, old):
+        immediate, deferred = staged_postconditions(posts, args, rargs, history, result, old)
+        run_checks(name, immediate)
+        if deferred:
+            get_deferred_checker().submit(name, deferred)
+
+    async def check_awaited_preconditions(pres, args, rargs):
+        history, checks = [], []
+        for condition in pres:
+            if condition.transformer:
+                await check_awaited(name, checks, PreconditionError)
+                history.append(rargs)
+                rargs, checks = apply_transform(condition, rargs), []
+            else:
+                checks.append((condition, (args[0],) if condition.instance else (rargs,)))
+        await check_awaited(name, checks, PreconditionError)
+        return rargs, history
+
+    async def check_awaited_postconditions(posts, args, rargs, history, result, old):
+        immediate, deferred = staged_postconditions(posts, args, rargs, history, result, old)
+        await check_awaited(name, immediate, PostconditionError)
+        if deferred:
+            defer_checks(name, deferred)
+
+    if iscoroutinefunction(func):
+        async def checked_call(current, args, kwargs, rargs=None):
+            if current is None:
+                return await func(*args, **kwargs)
+
+            if current.uses_args and rargs is None:
+                if active_profiler is None:
+                    rargs = binder(*args, **kwargs)
+                else:
+                    rargs = profiled_bind(args, kwargs)
+            pres = current.pres
+            tracked = tracker is not None and current.invariant_pres
+            if tracked and tracker.is_clean(args[0]):
+                pres, tracked = current.plain_pres, False
+            history = None
+            if awaiting:
+                rargs, history = await check_awaited_preconditions(pres, args, rargs)
+            elif current.transforms:
+                rargs, history = check_transforming_preconditions(pres, args, rargs)
+            elif current.inline_pres is not None and active_profiler is None:
+                current.inline_pres(args, rargs)
+            else:
+                check_preconditions(pres, args, rargs)
+            if tracked:
+                tracker.mark_clean(args[0])
+
+            old = preserve_values(rargs) if current.takes_old else None
+            if current.budgets is not None:
+                start = perf_counter()
+            if current.transforms:
+                result = await unbind(binder, func, rargs)
+            else:
+                result = await func(*args, **kwargs)
+            if current.budgets is not None:
+                record_call(current.budgets, perf_counter() - start)
+
+            posts = current.posts
+            tracked = tracker is not None and current.invariant_posts
+            if tracked and tracker.is_clean(args[0]):
+                posts, tracked = current.plain_posts, False
+            if awaiting:
+                await check_awaited_postconditions(posts, args, rargs, history, result, old)
+            elif current.transforms:
+                check_staged_postconditions(posts, args, rargs, history, result, old)
+            elif current.inline_posts is not None and active_profiler is None:
+                current.inline_posts(args, rargs, result, old)
+            else:
+                check_postconditions(posts, args, rargs, result, old)
+            if tracked:
+                tracker.mark_clean(args[0])
+            return result
+
+        if memo is None:
+            call = checked_call
+        else:
+            async def call(current, args, kwargs):
+                if active_profiler is None:
+                    rargs = binder(*args, **kwargs)
+                else:
+                    rargs = profiled_bind(args, kwargs)
+                try:
+                    key = memo_key(rargs)
+                except TypeError:
+                    return await checked_call(current, args, kwargs, rargs)
+                result = memo.get(key)
+                if result is not missing:
+                    return result
+                result = await checked_call(current, args, kwargs, rargs)
+                if current is plans[FULL]:
+                    memo.put(key, result)
+                return result
+
+        if recursion != 1:
+            checked_depth = call
+
+            async def call(current, args, kwargs):
+                # Below the outermost call, the depth need only be counted
+                # when checking every so many levels.
+                level = depth.get()
+                if level and not recursion:
+                    return await checked_depth(plans[OFF], args, kwargs)
+                if recursion and level % recursion:
+                    current = plans[OFF]
+                token = depth.set(level + 1)
+                try:
+                    return await checked_depth(current, args, kwargs)
+                finally:
+                    depth.reset(token)
+
+        if track_nested:
+            @wraps(f)
+            async def inner(*args, **kwargs):
+                current = select_plan()
+                active = active_instances.get()
+                instance = id(args[0])
+                if instance in active:
+                    return await call(current and current.nested(), args, kwargs)
+
+                token = active_instances.set(active | frozenset((instance,)))
+                try:
+                    return await call(current, args, kwargs)
+                finally:
+                    active_instances.reset(token)
+        else:
+            @wraps(f)
+            async def inner(*args, **kwargs):
+                return await call(select_plan(), args, kwargs)
+
+    elif isfunction(func):
+        def checked_call(current, args, kwargs, rargs=None):
+            if current is None:
+                return func(*args, **kwargs)
+
+            if current.uses_args and rargs is None:
+                if active_profiler is None:
+                    rargs = binder(*args, **kwargs)
+                else:
+                    rargs = profiled_bind(args, kwargs)
+            pres = current.pres
+            tracked = tracker is not None and current.invariant_pres
+            if tracked and tracker.is_clean(args[0]):
+                pres, tracked = current.plain_pres, False
+            history = None
+            if current.transforms:
+                rargs, history = check_transforming_preconditions(pres, args, rargs)
+            elif current.inline_pres is not None and active_profiler is None:
+                current.inline_pres(args, rargs)
+            else:
+                check_preconditions(pres, args, rargs)
+            if tracked:
+                tracker.mark_clean(args[0])
+
+            old = preserve_values(rargs) if current.takes_old else None
+            if current.budgets is not None:
+                start = perf_counter()
+            if current.transforms:
+                result = unbind(binder, func, rargs)
+            else:
+                result = func(*args, **kwargs)
+            if current.budgets is not None:
+                record_call(current.budgets, perf_counter() - start)
+
+            posts = current.posts
+            tracked = tracker is not None and current.invariant_posts
+            if tracked and tracker.is_clean(args[0]):
+                posts, tracked = current.plain_posts, False
+            if deferring or current.transforms:
+                check_staged_postconditions(posts, args, rargs, history or [], result, old)
+            elif current.inline_posts is not None and active_profiler is None:
+                current.inline_posts(args, rargs, result, old)
+            else:
+                check_postconditions(posts, args, rargs, result, old)
+            if tracked:
+                tracker.mark_clean(args[0])
+            return result
+
+        if memo is None:
+            call = checked_call
+        else:
+            def call(current, args, kwargs):
+                if active_profiler is None:
+                    rargs = binder(*args, **kwargs)
+                else:
+                    rargs = profiled_bind(args, kwargs)
+                try:
+                    key = memo_key(rargs)
+                except TypeError:
+                    return checked_call(current, args, kwargs, rargs)
+                result = memo.get(key)
+                if result is not missing:
+                    return result
+                result = checked_call(current, args, kwargs, rargs)
+                if current is plans[FULL]:
+                    memo.put(key, result)
+                return result
+
+        if recursion != 1:
+            checked_depth = call
+
+            def call(current, args, kwargs):
+                level = depth.get()
+                if level and not recursion:
+                    return checked_depth(plans[OFF], args, kwargs)
+                if recursion and level % recursion:
+                    current = plans[OFF]
+                token = depth.set(level + 1)
+                try:
+                    return checked_depth(current, args, kwargs)
+                finally:
+                    depth.reset(token)
+
+        if track_nested:
+            @wraps(f)
+            def inner(*args, **kwargs):
+                current = select_plan()
+                active = active_instances.get()
+                instance = id(args[0])
+                if instance in active:
+                    return call(current and current.nested(), args, kwargs)
+
+                token = active_instances.set(active | frozenset((instance,)))
+                try:
+                    return call(current, args, kwargs)
+                finally:
+                    active_instances.reset(token)
+        else:
+            @wraps(f)
+            def inner(*args, **kwargs):
+                return call(select_plan(), args, kwargs)
+
+    else:
+        raise NotImplementedError
+
+    inner.__wrapped__ = func
+    inner.__contract_wrapped_func__ = wrapped
+    inner.__contracts__ = contracts
+    contracts.wrapper = inner
+    return inner
+
+def condition(description, predicate, precondition=False, postcondition=False, instance=False,
+              sample=None, executor=None, deferred=False):
+    assert description is None or isinstance(description, str), \
+        "contract descriptions must be strings"
+    assert description is None or len(description) > 0, "contracts must have nonempty descriptions"
+    assert isfunction(predicate), "contract predicates must be functions"
+    assert not instance or not iscoroutinefunction(predicate), "invariant predicates cannot be coroutines"
+    assert precondition or postcondition, "contracts must be at least one of pre- or post-conditional"
+    assert executor is None or executor is True or hasattr(executor, "submit"), \
+        "executors must be True or have a `submit` method"
+    assert not deferred or (postcondition and not precondition), "only postconditions can be deferred"
+    if instance or precondition:
+        assert arg_count(predicate) == 1, "invariant predicates must take one argument"
+    elif postcondition:
+        assert arg_count(predicate) in (2, 3), "postcondition predicates must take two or three arguments"
+
+    new = Condition(description, predicate, precondition, postcondition, instance,
+                    as_sampler(sample), executor, deferred)
+
+    def require(f):
+        return add_conditions(f, [new])
+    return require
+
+def require(arg1, arg2=None, sample=None, executor=None):
+    """
+    Specify a precondition described by `description` and tested by
+    `predicate`, optionally checked only on calls selected by the sampling
+    policy `sample`.  On coroutine functions, `executor` runs the predicate
+    in an executor (or the event loop's default one, if True).
+    """
+
+    assert (isinstance(arg1, str) and isfunction(arg2)) or (isfunction(arg1) and arg2 is None)
+
+    description = ""
+    predicate = lambda x: x
+
+    if isinstance(arg1, str):
+        description = arg1
+        predicate = arg2
+    else:
+        description = None
+        predicate = arg1
+
+    return condition(description, predicate, True, False, sample=sample, executor=executor)
+
+def rewrite(args, **kwargs):
+    return args._replace(**kwargs)
+
+def preserve(preserver):
+    """
+    Preserve the values in the dict returned by `preserver`, called with the
+    function's arguments before each call, for postconditions taking three
+    arguments.  Preservers are only run when such a postcondition is checked,
+    once per call however many there are.
+    """
+
+    assert isfunction(preserver), "preservers must be functions"
+    assert arg_count(preserver) == 1, "preservers can only take a single argument"
+
+    def func(f):
+        contracts = get_contracts(f)
+        preservers = contracts.preservers if contracts is not None else ()
+        return add_conditions(f, [], preservers=preservers + (preserver,))
+    return func
+
+def transform(transformer):
+    """
+    Replace the arguments seen by the contracts below and by the function
+    itself with those in the `Args` tuple returned by `transformer`, which is
+    passed the arguments bound once for the whole stack of contracts.
+    """
+
+    assert isfunction(transformer), "transformers must be functions"
+    assert arg_count(transformer) == 1, "transformers can only take a single argument"
+
+    new = Condition("transform", transformer, True, True, False, transformer=True)
+
+    def func(f):
+        return add_conditions(f, [new])
+    return func
+
+type_checking = {"depth": None, "items": None}
+
+def set_type_checking(depth=None, items=None):
+    """
+    Limit how deeply `types` looks into containers: `depth` is the number of
+    levels of nested containers whose items are checked and `items` is the
+    number of items checked per container, with `None` meaning no limit.
+    The limits apply to functions decorated afterwards.
+    """
+
+    assert depth is None or (isinstance(depth, int) and depth >= 0), "depth must be a nonnegative integer"
+    assert items is None or (isinstance(items, int) and items >= 0), "items must be a nonnegative integer"
+    type_checking["depth"] = depth
+    type_checking["items"] = items
+
+def instance_checker(kinds):
+    """
+    Return a function testing `isinstance(value, kinds)`, caching the answer
+    for each concrete type of value seen, held weakly.  Nothing is cached
+    for kinds whose metaclass decides membership itself, such as abstract
+    base classes, to which types can be registered at any time.
+    """
+
+    kinds_tuple = kinds if isinstance(kinds, tuple) else (kinds,)
+    if any(getattr(type(kind), "__instancecheck__", None) is not type.__instancecheck__
+           for kind in kinds_tuple):
+        return lambda value: isinstance(value, kinds)
+
+    cache = WeakKeyDictionary()
+
+    def check(value):
+        kind = type(value)
+        try:
+            return cache[kind]
+        except KeyError:
+            result = cache[kind] = isinstance(value, kinds)
+            return result
+    return check
+
+def accept(value):
+    return True
+
+def any_checker(checkers):
+    if len(checkers) == 1:
+        return checkers[0]
+    return lambda value: any(check(value) for check in checkers)
+
+def type_checker(kind, depth=None, items=None):
+    """
+    Compile a function testing whether a value is of type `kind`, which may
+    be a class, `None`, a tuple of those, or a `typing` construct such as
+    `Optional[int]`, `Union[int, str]`, `List[int]` or `Dict[str, X]`.
+    Items of containers are checked down to `depth` levels, and no more than
+    `items` of them per container.
+    """
+
+    if kind is None:
+        return instance_checker(type(None))
+
+    if isinstance(kind, tuple):
+        plain = tuple(type(None) if k is None else k for k in kind
+                      if k is None or (isinstance(k, type) and not hasattr(k, "__origin__")))
+        checkers = [type_checker(k, depth, items) for k in kind if k is not None and k not in plain]
+        if plain:
+            checkers.insert(0, instance_checker(plain))
+        return any_checker(checkers)
+
+    if isinstance(kind, type) and getattr(kind, "__origin__", None) is None:
+        return instance_checker(kind)
+
+    import typing
+
+    if kind is typing.Any:
+        return accept
+
+    if isinstance(kind, typing.TypeVar):
+        if kind.__bound__ is not None:
+            return type_checker(kind.__bound__, depth, items)
+        if kind.__constraints__:
+            return type_checker(kind.__constraints__, depth, items)
+        return accept
+
+    origin = getattr(kind, "__origin__", None)
+    args = getattr(kind, "__args__", None) or ()
+
+    if origin is typing.Union or type(kind).__name__ == "UnionType":
+        return type_checker(tuple(args), depth, items)
+
+    if origin is getattr(typing, "Literal", None):
+        return lambda value: any(value is v or (type(value) is type(v) and value == v) for v in args)
+
+    if origin is type:
+        if not args or not isinstance(args[0], type):
+            return instance_checker(type)
+        return lambda value: isinstance(value, type) and issubclass(value, args[0])
+
+    if not isinstance(origin, type):
+        # Forward references, callables with special forms and the like can't
+        # be checked with `isinstance`, so accept anything for them.
+        return instance_checker(kind) if isinstance(kind, type) else accept
+
+    from collections.abc import Mapping, Sized
+
+    outer = instance_checker(origin)
+    if not args or depth == 0 or not issubclass(origin, Sized) or \
+       all(a is typing.Any or a is Ellipsis for a in args):
+        return outer
+
+    deeper = None if depth is None else depth - 1
+
+    if issubclass(origin, tuple) and not (len(args) == 2 and args[1] is Ellipsis):
+        if args == ((),):
+            return lambda value: outer(value) and len(value) == 0
+        members = [type_checker(a, deeper, items) for a in args]
+        return lambda value: outer(value) and len(value) == len(members) and \
+                             all(check(v) for check, v in zip(members, value))
+
+    if issubclass(origin, Mapping):
+        keys = type_checker(args[0], deeper, items)
+        values = type_checker(args[-1], deeper, items)
+        return lambda value: outer(value) and \
+                             all(keys(k) and values(v) for k, v in islice(value.items(), items))
+
+    member = type_checker(args[0], deeper, items)
+    return lambda value: outer(value) and all(map(member, islice(value, items)))
+
+def type_hints(func):
+    """
+    Return the annotations of `func`, resolving those given as strings.
+    Any that cannot be resolved are left out, with a warning.
+    """
+
+    import typing
+
+    try:
+        return typing.get_type_hints(func)
+    except Exception:
+        pass
+
+    hints = {}
+    for name, hint in getattr(func, "__annotations__", {}).items():
+        stub = lambda: None
+        stub.__annotations__ = {name: hint}
+        try:
+            hints.update(typing.get_type_hints(stub, func.__globals__))
+        except Exception:
+            import warnings
+
+            warnings.warn("cannot resolve the annotation %r of `%s` of %s" %
+                          (hint, name, function_name(func)))
+    return hints
+
+def compile_type_predicate(func, requirements, depth, items):
+    """
+    Generate a precondition predicate checking the type of each argument of
+    `func` named in `requirements`, indexing the `Args` tuple directly.
+    """
+
+    varkw = getfullargspec(func)[2]
+    fields = get_binder(func).Args._fields
+    namespace = {"lookup": argument_lookup}
+    tests = []
+    for i, (name, kind) in enumerate(sorted(requirements.items())):
+        namespace["check_%d" % i] = type_checker(kind, depth, items)
+        if name in fields:
+            tests.append("check_%d(args[%d])" % (i, fields.index(name)))
+        else:
+            assert varkw, "missing required argument `%s`" % name
+            tests.append("check_%d(lookup(args[-1], %r))" % (i, name))
 
-This module was written by Rob King (jking@deadpixi.com).
+    exec("def predicate(args):\n    return %s" % (" and ".join(tests) or "True"), namespace)
+    return namespace["predicate"]
 
-This program is free software: you can redistribute it and/or modify
-it under the terms of the GNU Lesser General Public License as published by
-the Free Software Foundation, either version 3 of the License, or
-(at your option) any later version.
+def argument_lookup(kwargs, name):
+    assert name in kwargs, "missing required argument `%s`" % name
+    return kwargs[name]
 
-This program is distributed in the hope that it will be useful,
-but WITHOUT ANY WARRANTY; without even the implied warranty of
-MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-GNU Lesser General Public License for more details.
+def types(**requirements):
+    """
+    Specify a precondition based on the types of the function's
+    arguments.  Given no requirements, the function's annotations are used
+    instead, and an annotated return type becomes a postcondition.
+    """
 
-You should have received a copy of the GNU Lesser General Public License
-along with this program.  If not, see <http://www.gnu.org/licenses/>.
-"""
+    def func(f):
+        wrapped = get_wrapped_func(f)
+        depth, items = type_checking["depth"], type_checking["items"]
+        named, vargs, varkw, _, kwonly, _, _ = getfullargspec(wrapped)
+        if requirements:
+            for name in requirements:
+                assert varkw or name in named or name == vargs or name in kwonly, \
+                    "missing required argument `%s`" % name
+            checks_arguments, checks_result = True, False
+        else:
+            annotations = getattr(wrapped, "__annotations__", {})
+            checks_arguments = any(name != "return" for name in annotations)
+            checks_result = "return" in annotations
+
+        # The annotations are resolved, and the checks compiled, on the first
+        # call, by when names defined after the function, such as its own
+        # class, can be found.
+        checks = None
+
+        def prepare():
+            nonlocal checks
+            required, result = requirements, None
+            if not required:
+                import typing
+
+                required = type_hints(wrapped)
+                result = required.pop("return", None)
+                if vargs in required:
+                    required[vargs] = typing.Tuple[required[vargs], ...]
+                if varkw in required:
+                    required[varkw] = typing.Dict[str, required[varkw]]
+            checks = (compile_type_predicate(wrapped, required, depth, items),
+                      None if result is None else type_checker(result, depth, items))
+            return checks
+
+        def check_arguments(args):
+            return (checks or prepare())[0](args)
+
+        def check_result(args, result):
+            check = (checks or prepare())[1]
+            return check is None or check(result)
+
+        conditions = []
+        if checks_arguments:
+            conditions.append(Condition("the types of arguments must be valid", check_arguments,
+                                        True, False, False, None, typed=True))
+        if checks_result:
+            conditions.append(Condition("the type of the result must be valid", check_result,
+                                        False, True, False, None, typed=True))
+        return add_conditions(f, conditions) if conditions else f
+    return func
 
-__all__ = ["ensure", "invariant", "require", "transform", "rewrite",
-           "preserve", "PreconditionError", "PostconditionError"]
-__author__ = "Rob King"
-__copyright__ = "Copyright (C) 2015-2018 Rob King"
-__license__ = "LGPL"
-__version__ = "$Id$"
-__email__ = "jking@deadpixi.com"
-__status__ = "Alpha"
+def numpy_array(values):
+    """
+    Return the NumPy module if `values` is a NumPy array, or None.  NumPy is
+    never imported here; if it has not been imported, there are no arrays.
+    """
 
-from ast import parse
-from collections import namedtuple
-from functools import wraps
-from inspect import isfunction, ismethod, iscoroutinefunction, getfullargspec, getsource
-from sys import version_info
+    numpy = modules.get("numpy")
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return numpy
+    return None
 
-if version_info[:2] < (3, 5):
-    raise ImportError('dpcontracts >= 0.6 requires Python 3.5 or later.')
+def array_index(numpy, values, mask):
+    """
+    Return the index of the first item of `values` selected by `mask`, along
+    with that item as a Python value.
+    """
 
-class PreconditionError(AssertionError):
-    """An AssertionError raised due to violation of a precondition."""
+    index = numpy.flatnonzero(mask)[0]
+    if values.ndim > 1:
+        index = tuple(int(i) for i in numpy.unravel_index(index, values.shape))
+    else:
+        index = int(index)
+    return index, values[index].item()
 
-class PostconditionError(AssertionError):
-    """An AssertionError raised due to violation of a postcondition."""
+def reiterable(values):
+    """
+    Return `values`, or a list of its items if it is an iterator that can
+    only be iterated over once, such as a generator.
+    """
 
-def get_function_source(func):
-    try:
-        source = getsource(func)
-        tree = parse(source)
-        decorators = tree.body[0].decorator_list
-        function = tree.body[0]
-        first_line = decorators[0].lineno
-        following_line = first_line + 1
-        if len(decorators) > 1:
-            following_line = decorators[1].lineno
-        elif len(function.body) > 0:
-            following_line = function.body[0].lineno - 1
-        return "\n".join(source.split("\n")[first_line - 1:following_line - first_line]) + " failed"
-
-    except (SyntaxError, OSError):
-        return str(func)
+    return list(values) if iter(values) is values else values
 
-def get_wrapped_func(func):
-    while hasattr(func, '__contract_wrapped_func__'):
-        func = func.__contract_wrapped_func__
-    return func
+def first_failure(values, test):
+    for index, value in enumerate(values):
+        if not test(value):
+            return index, value
 
-def build_call(func, *args, **kwargs):
+def in_bounds(values, low=None, high=None):
     """
-    Build an argument dictionary suitable for passing via `**` expansion given
-    function `f`, positional arguments `args`, and keyword arguments `kwargs`.
+    Check that every item of `values` is at least `low` and at most `high`,
+    either of which may be None to leave that side unbounded.
     """
 
-    func = get_wrapped_func(func)
-    named, vargs, _, defs, kwonly, kwonlydefs, _ = getfullargspec(func)
+    numpy = numpy_array(values)
+    if numpy is not None:
+        mask = numpy.zeros(values.shape, dtype=bool)
+        if low is not None:
+            mask |= ~(values >= low)
+        if high is not None:
+            mask |= ~(values <= high)
+        if mask.any():
+            return Failure("item %r (%r) is out of bounds" % array_index(numpy, values, mask))
+        return True
 
-    nonce = object()
-    actual = dict((name, nonce) for name in named)
+    values = reiterable(values)
+    if ((low is None or all(map(le, repeat(low), values))) and
+            (high is None or all(map(ge, repeat(high), values)))):
+        return True
+    index, value = first_failure(values, lambda value: (low is None or low <= value) and
+                                                       (high is None or value <= high))
+    return Failure("item %r (%r) is out of bounds" % (index, value))
 
-    defs = defs or ()
-    kwonlydefs = kwonlydefs or {}
+def all_finite(values):
+    """
+    Check that every item of `values` is finite: neither infinite nor NaN.
+    """
 
-    actual.update(kwonlydefs)
-    actual.update(dict(zip(reversed(named), reversed(defs))))
-    actual.update(dict(zip(named, args)))
+    numpy = numpy_array(values)
+    if numpy is not None:
+        mask = ~numpy.isfinite(values)
+        if mask.any():
+            return Failure("item %r (%r) is not finite" % array_index(numpy, values, mask))
+        return True
 
-    if vargs:
-        actual[vargs] = tuple(args[len(named):])
+    values = reiterable(values)
+    if all(map(isfinite, values)):
+        return True
+    index, value = first_failure(values, isfinite)
+    return Failure("item %r (%r) is not finite" % (index, value))
 
-    actual.update(kwargs)
+def has_dtype(values, dtype):
+    """
+    Check that the items of `values` are of type `dtype`: a NumPy array's
+    dtype must be `dtype` or a subtype of it, and every item of any other
+    iterable must be an instance of `dtype`.
+    """
 
-    for name, value in actual.items():
-        if value is nonce:
-            raise TypeError("%s missing required positional argument: '%s'" % (func.__name__, name))
+    numpy = numpy_array(values)
+    if numpy is not None:
+        if numpy.issubdtype(values.dtype, dtype):
+            return True
+        return Failure("dtype %s is not %s" % (values.dtype, getattr(dtype, "__name__", dtype)))
 
-    return tuple_of_dict(actual)
+    values = reiterable(values)
+    if all(map(isinstance, values, repeat(dtype))):
+        return True
+    index, value = first_failure(values, lambda value: isinstance(value, dtype))
+    return Failure("item %r (%r) is not of type %s" % (index, value, dtype.__name__))
 
-def tuple_of_dict(dictionary, name="Args"):
-    assert isinstance(dictionary, dict), "dictionary must be a dict instance"
-    return namedtuple(name, dictionary.keys())(**dictionary)
+def is_sequence(value):
+    return hasattr(value, "__len__") and not isinstance(value, (str, bytes, bytearray))
 
-def arg_count(func):
-    named, vargs, _, defs, kwonly, kwonlydefs, _ = getfullargspec(func)
-    return len(named) + len(kwonly) + (1 if vargs else 0)
+def has_shape(values, shape):
+    """
+    Check that `values` has the dimensions given by the tuple `shape`, in
+    which None matches any length.  Sequences other than NumPy arrays are
+    treated as nested sequences, each level being one dimension, and all of
+    the sequences at each level must have the same length.  Strings, and
+    anything else that is not a sequence, have no dimensions.
+    """
 
-def condition(description, predicate, precondition=False, postcondition=False, instance=False):
-    assert isinstance(description, str), "contract descriptions must be strings"
-    assert len(description) > 0, "contracts must have nonempty descriptions"
-    assert isfunction(predicate), "contract predicates must be functions"
-    assert not iscoroutinefunction(predicate), "contract predicates cannot be coroutines"
-    assert precondition or postcondition, "contracts must be at least one of pre- or post-conditional"
-    if instance or precondition:
-        assert arg_count(predicate) == 1, "invariant predicates must take one argument"
-    elif postcondition:
-        assert arg_count(predicate) in (2, 3), "postcondition predicates must take two or three arguments"
+    actual = getattr(values, "shape", None) if numpy_array(values) is not None else None
+    if actual is None:
+        actual = []
+        level = [reiterable(values) if hasattr(values, "__iter__") else values]
+        # Levels beyond those in `shape` are looked at too, to find any
+        # extra dimensions.
+        while True:
+            sequences = set(is_sequence(item) for item in level)
+            if len(sequences) > 1:
+                return Failure("the sequences at dimension %d are ragged" % len(actual))
+            if sequences != {True}:
+                break
+            lengths = set(len(item) for item in level)
+            if len(lengths) > 1:
+                return Failure("the sequences at dimension %d are ragged" % len(actual))
+            actual.append(lengths.pop())
+            level = [item for sequence in level for item in sequence]
+        actual = tuple(actual)
+
+    if len(actual) == len(shape) and all(want is None or want == have
+                                         for want, have in zip(shape, actual)):
+        return True
+    return Failure("shape %r does not match %r" % (actual, tuple(shape)))
 
-    def require(f):
-        wrapped = get_wrapped_func(f)
+def is_monotonic(values, strict=False, decreasing=False):
+    """
+    Check that the items of `values` never decrease, or never increase if
+    `decreasing` is True.  If `strict` is True, neighbouring items may not
+    be equal either.
+    """
 
-        if iscoroutinefunction(f):
-            @wraps(f)
-            async def inner(*args, **kwargs):
-                rargs = build_call(f, *args, **kwargs) if not instance else args[0]
-
-                if precondition and not predicate(rargs):
-                    raise PreconditionError(description)
-
-                preserved_values = {}
-                for preserver in getattr(wrapped, "__contract_preserver__", [lambda x: {}]):
-                    preserved_values.update(preserver(rargs))
-                result = await f(*args, **kwargs)
-
-                if instance:
-                    if not predicate(rargs):
-                        raise PostconditionError(description)
-                elif postcondition:
-                    check = None
-                    if arg_count(predicate) == 3:
-                        check = predicate(rargs, result, tuple_of_dict(preserved_values))
-                    else:
-                        check = predicate(rargs, result)
-                    if not check:
-                        raise PostconditionError(description)
+    compare = {(False, False): le, (True, False): lt,
+               (False, True): ge, (True, True): gt}[strict, decreasing]
 
-                return result
+    numpy = numpy_array(values)
+    if numpy is not None:
+        assert values.ndim == 1, "only one-dimensional arrays can be monotonic"
+        mask = ~compare(values[:-1], values[1:])
+        if mask.any():
+            index = int(numpy.flatnonzero(mask)[0]) + 1
+            return Failure("item %r (%r) is out of order" % (index, values[index].item()))
+        return True
 
-        elif isfunction(f):
-            @wraps(f)
-            def inner(*args, **kwargs):
-                rargs = build_call(f, *args, **kwargs) if not instance else args[0]
-
-                if precondition and not predicate(rargs):
-                    raise PreconditionError(description)
-
-                preserved_values = {}
-                for preserver in getattr(wrapped, "__contract_preserver__", [lambda x: {}]):
-                    preserved_values.update(preserver(rargs))
-                result = f(*args, **kwargs)
-
-                if instance:
-                    if not predicate(rargs):
-                        raise PostconditionError(description)
-                elif postcondition:
-                    check = None
-                    if arg_count(predicate) == 3:
-                        check = predicate(rargs, result, tuple_of_dict(preserved_values))
-                    else:
-                        check = predicate(rargs, result)
-                    if not check:
-                        raise PostconditionError(description)
+    values = reiterable(values)
+    previous, following = tee(values)
+    next(following, None)
+    if all(map(compare, previous, following)):
+        return True
+    previous, following = tee(values)
+    next(following, None)
+    for index, (first, second) in enumerate(zip(previous, following), 1):
+        if not compare(first, second):
+            return Failure("item %r (%r) is out of order" % (index, second))
 
-                return result
+def all_unique(values):
+    """
+    Check that no item of `values` appears more than once.
+    """
 
-        else:
-            raise NotImplementedError
+    numpy = numpy_array(values)
+    if numpy is not None:
+        flat = values.ravel()
+        order = numpy.argsort(flat, kind="stable")
+        repeated = flat[order][1:] == flat[order][:-1]
+        if repeated.any():
+            mask = numpy.zeros(flat.shape, dtype=bool)
+            mask[order[1:][repeated]] = True
+            return Failure("item %r (%r) is a duplicate" %
+                           array_index(numpy, values, mask.reshape(values.shape)))
+        return True
 
-        inner.__contract_wrapped_func__ = wrapped
-        return inner
-    return require
+    values = reiterable(values)
+    try:
+        if len(set(values)) == len(values):
+            return True
+    except TypeError:
+        pass
 
-def require(arg1, arg2=None):
+    seen = []
+    for index, value in enumerate(values):
+        if value in seen:
+            return Failure("item %r (%r) is a duplicate" % (index, value))
+        seen.append(value)
+    return True
+
+def ensure(arg1, arg2=None, sample=None, executor=None, deferred=False):
     """
-    Specify a precondition described by `description` and tested by
-    `predicate`.
+    Specify a postcondition described by `description` and tested by
+    `predicate`, optionally checked only on calls selected by the sampling
+    policy `sample`.  On coroutine functions, `executor` runs the predicate
+    in an executor (or the event loop's default one, if True).  A `deferred`
+    postcondition is checked in the background, its violations going to
+    the violation handler instead of the caller.
     """
 
     assert (isinstance(arg1, str) and isfunction(arg2)) or (isfunction(arg1) and arg2 is None)
@@ -663,97 +3031,515 @@ def require(arg1, arg2=None):
         description = arg1
         predicate = arg2
     else:
-        description = get_function_source(arg1)
+        description = None
         predicate = arg1
 
-    return condition(description, predicate, True, False)
+    return condition(description, predicate, False, True, sample=sample, executor=executor,
+                     deferred=deferred)
 
-def rewrite(args, **kwargs):
-    return args._replace(**kwargs)
+def checked_items(iterable, condition, error, prefix, sampler):
+    """
+    Yield the items of `iterable`, raising `error` as soon as an item fails
+    the predicate of `condition`.  Only the first `prefix` items are checked
+    if `prefix` is not None, and only items selected by `sampler` if it is
+    not None.
+    """
 
-def preserve(preserver):
-    assert isfunction(preserver), "preservers must be functions"
-    assert arg_count(preserver) == 1, "preservers can only take a single argument"
+    predicate = condition.predicate
+    for index, item in enumerate(iterable):
+        if prefix is not None and index >= prefix:
+            yield item
+            yield from iterable
+            return
+        if sampler is None or sampler():
+            check = predicate(item)
+            if not check:
+                raise error("%s: item %d (%r)" % (failure_message(condition.description, check),
+                                                   index, item))
+        yield item
+
+class checked_async_items:
+    """
+    The asynchronous counterpart of `checked_items`, written as a class as
+    Python 3.5 has no asynchronous generators.
+    """
+
+    def __init__(self, iterable, condition, error, prefix, sampler):
+        self.iterator = iterable.__aiter__()
+        self.condition = condition
+        self.error = error
+        self.prefix = prefix
+        self.sampler = sampler
+        self.index = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.iterator.__anext__()
+        index = self.index
+        self.index += 1
+        if (self.prefix is None or index < self.prefix) and \
+           (self.sampler is None or self.sampler()):
+            check = self.condition.predicate(item)
+            if not check:
+                raise self.error("%s: item %d (%r)" % (
+                    failure_message(self.condition.description, check), index, item))
+        return item
+
+def checked_stream(iterable, condition, error, prefix, sampler):
+    """
+    Return `iterable` with its items checked.  Iterators, which can only be
+    iterated once, are replaced by iterators checking each item as it is
+    consumed; other iterables, such as lists, are checked at once and
+    returned unchanged.
+    """
+
+    if hasattr(iterable, "__aiter__"):
+        return checked_async_items(iterable, condition, error, prefix, sampler)
+    iterator = iter(iterable)
+    if iterator is iterable:
+        return checked_items(iterator, condition, error, prefix, sampler)
+    if prefix is not None:
+        iterator = islice(iterator, prefix)
+    for _ in checked_items(iterator, condition, error, None, sampler):
+        pass
+    return iterable
+
+def stream_condition(arg1, arg2):
+    """
+    Return the description and predicate given as either a description and
+    a predicate, or just a predicate.
+    """
+
+    assert (isinstance(arg1, str) and isfunction(arg2)) or (isfunction(arg1) and arg2 is None)
+    if isinstance(arg1, str):
+        return arg1, arg2
+    return None, arg1
+
+def require_each(arg1, arg2, arg3=None, prefix=None, sample=None):
+    """
+    Specify a precondition that every item of the iterable argument `name`
+    satisfies `predicate`, optionally with a `description`:
+
+        require_each([description,] name, predicate)
+
+    An iterator argument is replaced by an iterator that checks each item as
+    it is consumed, so it is never materialized; other iterables, such as
+    lists, are checked before the call and passed unchanged.  Only the first `prefix`
+    items are checked if `prefix` is given, and only items selected by the
+    sampling policy `sample` if it is given.
+    """
+
+    if arg3 is None:
+        name, (description, predicate) = arg1, stream_condition(arg2, None)
+    else:
+        name, (description, predicate) = arg2, stream_condition(arg1, arg3)
+    assert isinstance(name, str), "require_each needs the name of an argument"
+    assert arg_count(predicate) == 1, "item predicates must take one argument"
+    new = Condition(description, predicate, True, False, False)
+    sampler = as_sampler(sample)
 
     def func(f):
-        wrapped = get_wrapped_func(f)
-        @wraps(f)
-        def inner(*args, **kwargs):
-            return f(*args, **kwargs)
-        if not hasattr(wrapped, "__contract_preserver__"):
-            wrapped.__contract_preserver__ = []
-        wrapped.__contract_preserver__.append(preserver)
+        named, _, _, _, kwonly, _, _ = getfullargspec(get_wrapped_func(f))
+        assert name in named or name in kwonly, "unknown argument `%s`" % name
+        position = named.index(name) if name in named else None
+        module = get_wrapped_func(f).__module__
+
+        def check_argument(args, kwargs):
+            level = level_cache.get(module)
+            if (level if level is not None else resolve_level(module)) < PRE:
+                return args
+            scope = suppression.get()
+            if scope is not None and "pre" in scope[0]:
+                return args
+            if position is not None and position < len(args):
+                checked = checked_stream(args[position], new, PreconditionError, prefix, sampler)
+                return args[:position] + (checked,) + args[position + 1:]
+            if name in kwargs:
+                kwargs[name] = checked_stream(kwargs[name], new, PreconditionError, prefix, sampler)
+            return args
+
+        if iscoroutinefunction(f):
+            @wraps(f)
+            async def inner(*args, **kwargs):
+                return await f(*check_argument(args, kwargs), **kwargs)
+        else:
+            @wraps(f)
+            def inner(*args, **kwargs):
+                return f(*check_argument(args, kwargs), **kwargs)
+        inner.__contract_wrapped_func__ = get_wrapped_func(f)
         return inner
     return func
-            
-def transform(transformer):
-    assert isfunction(transformer), "transformers must be functions"
-    assert arg_count(transformer) == 1, "transformers can only take a single argument"
+
+def ensure_each(arg1, arg2=None, prefix=None, sample=None):
+    """
+    Specify a postcondition that every item of the iterable returned by the
+    function, such as a generator, satisfies `predicate`, optionally with a
+    `description`:
+
+        ensure_each([description,] predicate)
+
+    An iterator result is replaced by an iterator that checks each item as
+    it is consumed; other iterables, such as lists, are checked when the
+    function returns and returned unchanged.  The `prefix` and `sample` arguments are as for `require_each`.
+    """
+
+    description, predicate = stream_condition(arg1, arg2)
+    assert arg_count(predicate) == 1, "item predicates must take one argument"
+    new = Condition(description, predicate, False, True, False)
+    sampler = as_sampler(sample)
 
     def func(f):
-        @wraps(f)
-        def inner(*args, **kwargs):
-            rargs = transformer(build_call(f, *args, **kwargs))
-            return f(**(rargs._asdict()))
+        module = get_wrapped_func(f).__module__
+
+        def check_result(result):
+            level = level_cache.get(module)
+            if (level if level is not None else resolve_level(module)) < FULL:
+                return result
+            scope = suppression.get()
+            if scope is not None and "post" in scope[0]:
+                return result
+            return checked_stream(result, new, PostconditionError, prefix, sampler)
+
+        if iscoroutinefunction(f):
+            @wraps(f)
+            async def inner(*args, **kwargs):
+                return check_result(await f(*args, **kwargs))
+        else:
+            @wraps(f)
+            def inner(*args, **kwargs):
+                return check_result(f(*args, **kwargs))
+        inner.__contract_wrapped_func__ = get_wrapped_func(f)
         return inner
     return func
 
-def types(**requirements):
+class ChangeTracker:
     """
-    Specify a precondition based on the types of the function's
-    arguments.
+    Remembers which instances of a class have passed their invariants and
+    not been changed since.  Instances that cannot be weakly referenced are
+    never considered unchanged.
     """
 
-    def predicate(args):
-        for name, kind in sorted(requirements.items()):
-            assert hasattr(args, name), "missing required argument `%s`" % name
+    def __init__(self):
+        self.clean = {}
 
-            if not isinstance(kind, tuple):
-                kind = (kind,)
+    def is_clean(self, instance):
+        ref = self.clean.get(id(instance))
+        return ref is not None and ref() is instance
 
-            if not any(isinstance(getattr(args, name), k) for k in kind):
-                return False
+    def mark_clean(self, instance):
+        key = id(instance)
+        try:
+            self.clean[key] = ref(instance, lambda _, key=key: self.clean.pop(key, None))
+        except TypeError:
+            pass
 
-        return True
+    def mark_dirty(self, instance):
+        self.clean.pop(id(instance), None)
+
+tracked_methods = {
+    list: ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend",
+           "insert", "pop", "remove", "clear", "sort", "reverse"),
+    dict: ("__setitem__", "__delitem__", "__ior__", "pop", "popitem", "clear", "update",
+           "setdefault"),
+    set: ("__iand__", "__ior__", "__isub__", "__ixor__", "add", "discard", "remove", "pop",
+          "clear", "update", "difference_update", "intersection_update",
+          "symmetric_difference_update"),
+}
+
+def tracking_method(method):
+    @wraps(method)
+    def inner(self, *args, **kwargs):
+        if self.snapshots:
+            freeze_snapshots(self)
+        self.on_change()
+        return method(self, *args, **kwargs)
+    return inner
+
+class TrackedList(list):
+    """
+    A list calling its `on_change` attribute before every change to its
+    contents, and keeping weak references to the `Snapshot`s waiting for
+    its first change.  Copies and pickles of it are plain lists.
+    """
+
+    __slots__ = ("on_change", "snapshots")
 
-    return condition("the types of arguments must be valid", predicate, True)
+    def __reduce__(self):
+        return (list, (list(self),))
 
-def ensure(arg1, arg2=None):
+class TrackedDict(dict):
     """
-    Specify a precondition described by `description` and tested by
-    `predicate`.
+    The dict counterpart of `TrackedList`.
     """
 
-    assert (isinstance(arg1, str) and isfunction(arg2)) or (isfunction(arg1) and arg2 is None)
+    __slots__ = ("on_change", "snapshots")
 
-    description = ""
-    predicate = lambda x: x
+    def __reduce__(self):
+        return (dict, (dict(self),))
 
-    if isinstance(arg1, str):
-        description = arg1
-        predicate = arg2
-    else:
-        description = get_function_source(arg1)
-        predicate = arg1
+class TrackedSet(set):
+    """
+    The set counterpart of `TrackedList`.
+    """
+
+    __slots__ = ("on_change", "snapshots")
+
+    def __reduce__(self):
+        return (set, (set(self),))
+
+tracking_types = {list: TrackedList, dict: TrackedDict, set: TrackedSet}
+
+for base, kind in list(tracking_types.items()):
+    for name in tracked_methods[base]:
+        if hasattr(base, name):
+            setattr(kind, name, tracking_method(getattr(base, name)))
+    # A tracked container assigned elsewhere is copied, like any other, so
+    # that it reports changes to its new owner only.
+    tracking_types[kind] = kind
+
+def track_container(value, on_change):
+    """
+    Return a tracked copy of `value` if it is a list, dict or set, tracked
+    or not, calling `on_change` whenever its contents change, or `value`
+    itself otherwise.
+    """
+
+    kind = tracking_types.get(type(value))
+    if kind is None:
+        return value
+    value = kind(value)
+    value.on_change = on_change
+    value.snapshots = None
+    return value
+
+def selectors(paths):
+    """
+    Return `(name, getter)` pairs for `paths`, a dict mapping names to dotted
+    attribute paths into a function's arguments, such as `"self.value"`.
+    """
+
+    assert paths, "at least one attribute path must be given"
+    assert all(isinstance(path, str) for path in paths.values()), "attribute paths must be strings"
+    return [(name, attrgetter(path)) for name, path in sorted(paths.items())]
+
+def attributes(**paths):
+    """
+    Return a preserver keeping the values found at the given attribute
+    paths, without copying them.
+    """
 
-    return condition(description, predicate, False, True)
+    getters = selectors(paths)
 
-def invariant(arg1, arg2=None):
+    def preserver(args):
+        return dict((name, getter(args)) for name, getter in getters)
+    return preserver
+
+def digest(**paths):
+    """
+    Return a preserver keeping a SHA-1 digest of the bytes-like values found
+    at the given attribute paths.
+    """
+
+    from hashlib import sha1
+
+    getters = selectors(paths)
+
+    def preserver(args):
+        return dict((name, sha1(getter(args)).digest()) for name, getter in getters)
+    return preserver
+
+def buffer_snapshot(value):
+    view = memoryview(value)
+    if isinstance(view.obj, bytes):
+        return view
+    return memoryview(view.tobytes())
+
+def snapshot(**paths):
+    """
+    Return a preserver keeping a `memoryview` of the contents of the
+    bytes-like values found at the given attribute paths.  Immutable
+    `bytes` are viewed without copying; anything else is copied once.
+    """
+
+    getters = selectors(paths)
+
+    def preserver(args):
+        return dict((name, buffer_snapshot(getter(args))) for name, getter in getters)
+    return preserver
+
+def freeze_snapshots(container):
+    """
+    Give the `Snapshot`s waiting for the first change to the tracked
+    `container` a copy of its contents, before they change.
+    """
+
+    snapshots = [snapshot() for snapshot in container.snapshots.values()]
+    container.snapshots = None
+    copy = None
+    for snapshot in snapshots:
+        if snapshot is not None:
+            if copy is None:
+                copy = type(container).__bases__[0](container)
+            snapshot.copy = copy
+
+class Snapshot:
+    """
+    The contents of a container as of the moment the snapshot was taken.
+    Tracked containers are only copied when they are first changed
+    afterwards; others are copied immediately.  A tracked container only
+    refers weakly to its snapshots, so those of finished calls are simply
+    dropped.
+    """
+
+    __slots__ = ("live", "copy", "__weakref__")
+
+    def __init__(self, value):
+        self.live = value
+        self.copy = None
+        if type(value) in tracking_types.values():
+            if value.snapshots is None:
+                value.snapshots = {}
+            snapshots, key = value.snapshots, id(self)
+            snapshots[key] = ref(self, lambda _, key=key: snapshots.pop(key, None))
+        else:
+            from copy import copy
+
+            self.copy = copy(value)
+
+    @property
+    def value(self):
+        return self.live if self.copy is None else self.copy
+
+    def __eq__(self, other):
+        if isinstance(other, Snapshot):
+            other = other.value
+        return self.value == other
+
+    __hash__ = None
+
+    def __len__(self):
+        return len(self.value)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __contains__(self, item):
+        return item in self.value
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __repr__(self):
+        return "Snapshot(%r)" % (self.value,)
+
+def copy_on_write(**paths):
+    """
+    Return a preserver keeping `Snapshot`s of the containers found at the
+    given attribute paths.
+    """
+
+    getters = selectors(paths)
+
+    def preserver(args):
+        return dict((name, Snapshot(getter(args))) for name, getter in getters)
+    return preserver
+
+class Invariants:
+    """
+    The invariants of a class, outermost first, and the methods they are
+    checked around.  Each method gets a single wrapper checking all of the
+    invariants along with the method's own contracts.
+    """
+
+    __slots__ = ("conditions", "init_conditions", "methods", "nested", "tracker", "mutable")
+
+    def __init__(self, methods):
+        self.conditions = []
+        self.init_conditions = []
+        self.methods = methods
+        self.nested = True
+        self.tracker = None
+        self.mutable = frozenset()
+
+    def add(self, description, predicate, sampler, nested, track_changes, mutable):
+        self.conditions.insert(0, Condition(description, predicate, True, True, True, sampler))
+        self.init_conditions.insert(0, Condition(description, predicate, False, True, True, sampler))
+        self.nested = self.nested and nested
+        if (track_changes or mutable) and self.tracker is None:
+            self.tracker = ChangeTracker()
+        self.mutable = self.mutable.union(mutable)
+
+    def install(self, c):
+        for name, method in self.methods.items():
+            conditions = self.init_conditions if name == "__init__" else self.conditions
+            setattr(c, name, add_conditions(method, conditions, nested=self.nested,
+                                            tracker=self.tracker))
+
+        if self.tracker is not None:
+            tracker = self.tracker
+            mutable = self.mutable
+            base = c.__bases__[0]
+
+            def __setattr__(self, name, value):
+                tracker.mark_dirty(self)
+                if name in mutable:
+                    value = track_container(value, lambda: tracker.mark_dirty(self))
+                base.__setattr__(self, name, value)
+
+            def __delattr__(self, name):
+                tracker.mark_dirty(self)
+                base.__delattr__(self, name)
+
+            def __setstate__(self, state):
+                # Copies and unpickled instances get tracked containers of
+                # their own, reporting changes to them rather than to the
+                # instance they were copied from.
+                if base_setstate is not None:
+                    base_setstate(self, state)
+                else:
+                    state, slots = state if isinstance(state, tuple) else (state, None)
+                    for values in (state, slots):
+                        for name, value in (values or {}).items():
+                            base.__setattr__(self, name, value)
+                for name in mutable:
+                    value = getattr(self, name, missing)
+                    if value is not missing:
+                        base.__setattr__(self, name, track_container(
+                            value, lambda: tracker.mark_dirty(self)))
+                tracker.mark_dirty(self)
+
+            base_setstate = getattr(base, "__setstate__", None)
+            c.__setattr__ = __setattr__
+            c.__delattr__ = __delattr__
+            c.__setstate__ = __setstate__
+
+def invariant(arg1, arg2=None, sample=None, nested=True, track_changes=False, mutable=()):
     """
     Specify a class invariant described by `description` and tested
-    by `predicate`.
+    by `predicate`, optionally checked only on calls selected by the
+    sampling policy `sample`.  If `nested` is False, invariants are not
+    checked around calls made while another call on the same instance is
+    in progress.  If `track_changes` is True, invariants are only checked on
+    instances whose attributes have been set or deleted since they last
+    passed; the contents of the containers held in the attributes named in
+    `mutable` are tracked as well.
     """
 
-    desc = ""
+    desc = None
     predicate = lambda x: x
 
     if isinstance(arg1, str):
         desc = arg1
         predicate = arg2
     else:
-        desc = get_function_source(arg1)
         predicate = arg1
 
+    assert isfunction(predicate), "contract predicates must be functions"
+    assert arg_count(predicate) == 1, "invariant predicates must take one argument"
+    sampler = as_sampler(sample)
+
     def invariant(c):
         def check(name, func):
             exceptions = ("__getitem__", "__setitem__", "__lt__", "__le__", "__eq__",
@@ -762,7 +3548,7 @@ def invariant(arg1, arg2=None):
             if name.startswith("__") and name.endswith("__") and name not in exceptions:
                 return False
 
-            if not ismethod(func) and not isfunction(func):
+            if not isinstance(func, MethodType) and not isfunction(func):
                 return False
 
             if getattr(func, "__self__", None) is c:
@@ -770,28 +3556,42 @@ def invariant(arg1, arg2=None):
 
             return True
 
-        class InvariantContractor(c):
-            pass
-
-        for name, value in [(name, getattr(c, name)) for name in dir(c)]:
-            if check(name, value):
-                setattr(InvariantContractor, name,
-                        condition(desc, predicate, name != "__init__", True, True)(value))
-        return InvariantContractor
+        invariants = vars(c).get("__contract_invariants__")
+        if invariants is None:
+            class InvariantContractor(c):
+                # Add nothing to the layout of instances, so that those of
+                # classes with `__slots__` get no `__dict__` or `__weakref__`.
+                __slots__ = ()
+                __doc__ = c.__doc__
+
+            # Take the place of the class under its own name, so that its
+            # instances can be pickled.
+            InvariantContractor.__name__ = c.__name__
+            InvariantContractor.__qualname__ = c.__qualname__
+            InvariantContractor.__module__ = c.__module__
+            invariants = Invariants(dict((name, value) for name, value in
+                                         [(name, getattr(c, name)) for name in dir(c)]
+                                         if check(name, value)))
+            InvariantContractor.__contract_invariants__ = invariants
+            c = InvariantContractor
+
+        invariants.add(desc, predicate, sampler, nested, track_changes, tuple(mutable))
+        invariants.install(c)
+        return c
     return invariant
 
 if not __debug__:
-    def require(description, predicate):
+    def require(arg1, arg2=None, sample=None, executor=None):
         def func(f):
             return f
         return func
 
-    def ensure(description, predicate):
+    def ensure(arg1, arg2=None, sample=None, executor=None, deferred=False):
         def func(f):
             return f
         return func
 
-    def invariant(description, predicate):
+    def invariant(arg1, arg2=None, sample=None, nested=True, track_changes=False, mutable=()):
         def func(c):
             return c
         return func
@@ -806,6 +3606,31 @@ if not __debug__:
             return c
         return func
 
+    def types(**requirements):
+        def func(f):
+            return f
+        return func
+
+    def sampled(sample):
+        def func(f):
+            return f
+        return func
+
+    def recursive(every=None):
+        def func(f):
+            return f
+        return func
+
+    def require_each(arg1, arg2, arg3=None, prefix=None, sample=None):
+        def func(f):
+            return f
+        return func
+
+    def ensure_each(arg1, arg2=None, prefix=None, sample=None):
+        def func(f):
+            return f
+        return func
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the per-call overhead of dpcontracts.
+
+Each benchmark times calls to a function with a stack of contracts and to
+the same function without them, for every kind of contract, calling
+convention and stack depth.  The time taken to decorate a function with
+each stack, and to import dpcontracts, is measured as well.  Run it from
+the command line:
+
+    python -m dpcontracts_bench [--json] [--depth 1 4] [--kind require]
+
+Results are printed as a table, or with ``--json`` as a JSON document that
+can be saved and compared across releases.  The exit status is 1 if any
+benchmarked call raised an error.
+"""
+
+from argparse import ArgumentParser
+from json import dumps
+from platform import python_implementation, python_version
+from subprocess import check_output
+from sys import executable, exit, stdout
+from time import perf_counter
+from timeit import Timer
+
+import dpcontracts
+from dpcontracts import ensure, invariant, preserve, require, transform, types
+
+CONVENTIONS = {
+    "positional": ("a, b", "1, 2"),
+    "keyword": ("a, b", "a=1, b=2"),
+    "defaulted": ("a, b=2", "1"),
+    "varargs": ("a, *rest", "1, 2, 3"),
+    "kwonly": ("a, *, b", "1, b=2"),
+}
+
+def contracts(kind, depth):
+    """
+    Return the decorators of a stack of `depth` contracts of kind `kind`.
+    """
+
+    if kind == "require":
+        return [require("`a` must be positive", lambda args: args.a > 0)] * depth
+    if kind == "ensure":
+        return [ensure("the result must be positive", lambda args, result: result > 0)] * depth
+    if kind == "types":
+        return [types(a=int)] * depth
+    if kind == "preserve":
+        return [preserve(lambda args: {"a": args.a})] * depth + \
+               [ensure("`a` must be unchanged", lambda args, result, old: old.a == args.a)]
+    if kind == "transform":
+        return [transform(lambda args: args)] * depth
+    if kind == "invariant":
+        return [invariant("`x` must be positive", lambda self: self.x > 0)] * depth
+    raise ValueError("unknown kind of contract: %s" % kind)
+
+KINDS = ("require", "ensure", "types", "preserve", "transform", "invariant")
+
+def decorate(target, decorators):
+    for decorator in reversed(decorators):
+        target = decorator(target)
+    return target
+
+def define(convention, method=False, coroutine=False):
+    """
+    Return a function (or a class with a method `f`) taking arguments in
+    the calling convention `convention`, and the source of a call to it.
+    """
+
+    signature, arguments = CONVENTIONS[convention]
+    header = "%sdef f(%s%s):" % ("async " if coroutine else "", "self, " if method else "", signature)
+    if method:
+        source = "class C:\n    x = 1\n    %s\n        return a\n" % header
+    else:
+        source = "%s\n    return a\n" % header
+    namespace = {"__name__": __name__}
+    exec(source, namespace)
+    return namespace["C" if method else "f"], arguments
+
+def run_coroutine(coroutine):
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("benchmarked coroutines must not suspend")
+
+def thunk(target, arguments, method=False, coroutine=False):
+    """
+    Return a function of no arguments making one call to `target`.
+    """
+
+    namespace = {"target": target() if method else target, "run": run_coroutine}
+    call = "target%s(%s)" % (".f" if method else "", arguments)
+    if coroutine:
+        call = "run(%s)" % call
+    return eval("lambda: " + call, namespace)
+
+def cases(kinds, depths, conventions):
+    """
+    Generate the `(name, parameters, baseline, contracted)` of each
+    benchmark, the last two being functions of no arguments to be timed.
+    """
+
+    for kind in kinds:
+        for depth in depths:
+            for convention in conventions:
+                for target in ("method",) if kind == "invariant" else ("function", "method", "coroutine"):
+                    method, coroutine = target == "method", target == "coroutine"
+                    plain, arguments = define(convention, method, coroutine)
+                    decorated, _ = define(convention, method, coroutine)
+                    if kind == "invariant":
+                        decorated = decorate(decorated, contracts(kind, depth))
+                    elif method:
+                        decorated.f = decorate(decorated.f, contracts(kind, depth))
+                    else:
+                        decorated = decorate(decorated, contracts(kind, depth))
+                    parameters = {"kind": kind, "depth": depth, "convention": convention,
+                                  "target": target}
+                    name = "%s-%d-%s-%s" % (kind, depth, convention, target)
+                    yield (name, parameters, thunk(plain, arguments, method, coroutine),
+                           thunk(decorated, arguments, method, coroutine))
+
+def measure(function, number, repeat):
+    """
+    Return the best time of `repeat` runs, in nanoseconds per call.
+    """
+
+    return min(Timer(function).repeat(repeat=repeat, number=number)) / number * 1e9
+
+def measure_decoration(kind, depth, number):
+    """
+    Return the time taken to decorate a function (or, for invariants, a
+    class) with a stack of `depth` contracts of kind `kind`, in nanoseconds.
+    """
+
+    decorators = contracts(kind, depth)
+    targets = [define("positional", method=kind == "invariant")[0] for _ in range(number)]
+    start = perf_counter()
+    for target in targets:
+        decorate(target, decorators)
+    return (perf_counter() - start) / number * 1e9
+
+def measure_import(repeat):
+    """
+    Return the best time taken to import dpcontracts in a new interpreter,
+    in milliseconds.
+    """
+
+    code = ("from time import perf_counter; start = perf_counter(); import dpcontracts; "
+            "print(perf_counter() - start)")
+    return min(float(check_output([executable, "-c", code])) for _ in range(repeat)) * 1e3
+
+def run(kinds=KINDS, depths=(1, 4), conventions=tuple(CONVENTIONS), number=10000, repeat=5):
+    """
+    Run the benchmarks, returning a dict of the environment they ran in and
+    their results.
+    """
+
+    results = []
+    for name, parameters, baseline, contracted in cases(kinds, depths, conventions):
+        result = dict(parameters, name=name)
+        results.append(result)
+        try:
+            contracted()
+        except Exception as error:
+            result["error"] = "%s: %s" % (type(error).__name__, error)
+            continue
+        result["baseline_ns"] = measure(baseline, number, repeat)
+        result["contracted_ns"] = measure(contracted, number, repeat)
+        result["overhead_ns"] = result["contracted_ns"] - result["baseline_ns"]
+
+    decoration = []
+    for kind in kinds:
+        for depth in depths:
+            decoration.append({"kind": kind, "depth": depth,
+                               "decoration_ns": min(measure_decoration(kind, depth, number // 10 or 1)
+                                                    for _ in range(repeat))})
+
+    return {"python": python_version(), "implementation": python_implementation(),
+            "dpcontracts": dpcontracts.__version__, "number": number, "repeat": repeat,
+            "import_ms": measure_import(repeat), "results": results, "decoration": decoration}
+
+def report(results, out=stdout):
+    out.write("%-40s %12s %12s %12s\n" % ("benchmark", "baseline", "contracted", "overhead"))
+    for result in results["results"]:
+        if "error" in result:
+            out.write("%-40s %s\n" % (result["name"], result["error"]))
+            continue
+        out.write("%-40s %10.0fns %10.0fns %10.0fns\n" %
+                  (result["name"], result["baseline_ns"], result["contracted_ns"],
+                   result["overhead_ns"]))
+
+    out.write("\n%-40s %12s\n" % ("decoration", "time"))
+    for result in results["decoration"]:
+        out.write("%-40s %10.0fns\n" % ("%s-%d" % (result["kind"], result["depth"]),
+                                         result["decoration_ns"]))
+    out.write("\nimport: %.1fms\n" % results["import_ms"])
+
+def main(argv=None):
+    parser = ArgumentParser(description="Measure the per-call overhead of dpcontracts.")
+    parser.add_argument("--kind", nargs="+", choices=KINDS, default=list(KINDS),
+                        help="the kinds of contract to benchmark")
+    parser.add_argument("--depth", nargs="+", type=int, default=[1, 4],
+                        help="the numbers of stacked contracts to benchmark")
+    parser.add_argument("--convention", nargs="+", choices=list(CONVENTIONS),
+                        default=list(CONVENTIONS), help="the calling conventions to benchmark")
+    parser.add_argument("--number", type=int, default=10000, help="calls per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per benchmark")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    options = parser.parse_args(argv)
+
+    results = run(options.kind, options.depth, options.convention, options.number, options.repeat)
+    if options.json:
+        stdout.write(dumps(results, indent=2, sort_keys=True) + "\n")
+    else:
+        report(results)
+    return 1 if any("error" in result for result in results["results"]) else 0
+
+if __name__ == "__main__":
+    exit(main())
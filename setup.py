@@ -14,12 +14,12 @@ from setuptools import setup
 import dpcontracts
 
 setup(name="dpcontracts",
-      version="0.6.0",
+      version=dpcontracts.__version__,
       author="Rob King",
       author_email="jking@deadpixi.com",
       url="https://github.com/deadpixi/contracts",
       description="A simple implementation of contracts for Python.",
-      py_modules=['dpcontracts'],
+      py_modules=['dpcontracts', 'dpcontracts_bench'],
       python_requires='>=3.5',
       long_description=dpcontracts.__doc__,
       license="https://www.gnu.org/licenses/lgpl.txt",